@@ -13,16 +13,43 @@ __application__ = 'PM'    # we don't have a name yet...
 __default_config__ = '.PMrc'  # we don't have a name yet...
 __default_log__ = '.PM.log'   # we don't have a name yet...
 __project_config_file__ = '.PMrc.project'
-
+__results_file__ = '.PMresults'
+__registry_file__ = '.PMregistry'
+# commands that only run in the process they were given to, never in the
+# daemon or a batch.
+__local_commands__ = ('daemon', 'batch')
+
+# PM runs from editor hooks and shell prompts, so start up matters. The
+# rsync package, the thread pools and json are imported by the commands
+# that use them, not here.
 import os
-import re
-import datetime
+import sys
+from application.client import forward
+
+if __name__ == "__main__":
+    # a running daemon is warm, hand it the command before we import
+    # anything else.
+    status = forward(__application__, sys.argv[1:], local=__local_commands__)
+    if status is not None:
+        sys.exit(status)
+
+import argparse
+import heapq
+import shlex
+import logging
+import threading
 import configparser
+from contextlib import contextmanager
+from collections import OrderedDict
 
 
 from application import applicationCore
 from application import apperror
-from rsync import rsync
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 
 class Project_config ():
@@ -30,7 +57,7 @@ class Project_config ():
        of each project directory tree """
 
     def __init__(self, path, name=None, configfile=__project_config_file__,
-                 logger=None):
+                 logger=None, cache=None):
 
         if logger is not None:
             self.logger = logger
@@ -39,14 +66,17 @@ class Project_config ():
             logger = logging.getLogger(__application__).addHandler(logging.NullHandler())
 
         # load up the project config file. get the name.
-        self.config = configparser.SafeConfigParser()
         self.configfile = os.path.join(path, configfile)
-        if  os.path.isfile(self.configfile):
+        self.config = cache.load(self.configfile) if cache is not None else None
+        if self.config is None and os.path.isfile(self.configfile):
+            self.config = configparser.SafeConfigParser()
             self.config.read([self.configfile])
 
+        if self.config is not None:
             self.name = self.config['default']['name']
 
         else:
+            self.config = configparser.SafeConfigParser()
             #if we have a name we can make one. Otherwise we are done.
             if not name:
                 logger.error("Could not read configuration file %s" % self.configfile)
@@ -80,6 +110,114 @@ class Project_config ():
             raise Exception
 
 
+class Project_registry ():
+    """Every project instance we know of, its directory mapped to its
+       project name and config section, kept in ~/.PMregistry. Finding the
+       project we're in is then a few dictionary lookups up the path and
+       one stat, instead of a stat at every level and a config file read."""
+
+    def __init__(self, logger, registry_file=None):
+        self.logger = logger
+        if registry_file is None:
+            registry_file = os.path.join(os.getenv('HOME') or '/tmp', __registry_file__)
+        self.registry_file = registry_file
+        self.instances = None
+        self.lock = threading.Lock()
+
+    def read(self):
+        import json
+        try:
+            with open(self.registry_file) as registry:
+                return json.load(registry)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def load(self):
+        """The registry, read once."""
+        if self.instances is None:
+            self.instances = self.read()
+        return self.instances
+
+    def save(self, changes):
+        """Apply changes, path: entry or None to forget it, on top of what's
+        on disk now, so we don't lose what another PM just registered."""
+        import json
+        with self.lock:
+            instances = self.read()
+            for path, entry in changes.items():
+                if entry is None:
+                    instances.pop(path, None)
+                else:
+                    instances[path] = entry
+            temp_file = "%s.%d" % (self.registry_file, os.getpid())
+            try:
+                with open(temp_file, 'w') as registry:
+                    json.dump(instances, registry, indent=1, sort_keys=True)
+                os.replace(temp_file, self.registry_file)
+            except (IOError, OSError) as e:
+                self.logger.debug("Could not write %s: %s" % (self.registry_file, e))
+            self.instances = instances
+
+    def register(self, path, name, section=None):
+        path = os.path.abspath(path)
+        entry = {'name': name, 'section': section or name}
+        if self.load().get(path) != entry:
+            self.logger.debug("Registering %s as %s" % (path, name))
+            self.save({path: entry})
+
+    def unregister(self, path):
+        path = os.path.abspath(path)
+        if path in self.load():
+            self.save({path: None})
+
+    def lookup(self, directory):
+        """The instance directory holding directory and its entry, the
+        longest match, or (None, None). The instance's config file is
+        checked, so a directory that has gone away is forgotten."""
+        instances = self.load()
+        current = os.path.abspath(directory)
+        while True:
+            if current in instances:
+                if os.path.isfile(os.path.join(current, __project_config_file__)):
+                    return current, instances[current]
+                self.unregister(current)
+                return None, None
+            parent = os.path.dirname(current)
+            if parent == current:
+                return None, None
+            current = parent
+
+    def reindex(self, project_root, cache=None):
+        """Forget everything under project_root and find it all again. We
+        don't look inside a project once we've found it, or in dot
+        directories."""
+        project_root = os.path.abspath(project_root)
+        found = {}
+        for directory, directories, files in os.walk(project_root):
+            if __project_config_file__ in files:
+                config = Project_config(directory, logger=self.logger, cache=cache)
+                name = getattr(config, 'name', None)
+                if name:
+                    found[directory] = {'name': name, 'section': name}
+                directories[:] = []
+                continue
+            directories[:] = [d for d in directories if not d.startswith('.')]
+
+        changes = dict((path, None) for path in self.load()
+                       if path == project_root or path.startswith(project_root + os.sep))
+        changes.update(found)
+        self.save(changes)
+        return found
+
+
+class project_logger(logging.LoggerAdapter):
+    """ A logger that starts everything with which project it's about, for when
+        many projects share one log. """
+
+    def process(self, message, kwargs):
+        return '%s: %s' % (self.extra['project'], message), kwargs
+
+
 class PM(applicationCore):
     """
     This is a project manager to manage code deployed at remote
@@ -105,27 +243,18 @@ class PM(applicationCore):
         self.name = None            # Name of the project
         self.pconfig = None         # This is the project directory's config.
         self.open_command = None    # what we do to open a project.
-        self.excludes = None
+        self._excludes = None       # made when first needed.
+        self._rsync = None
         self.host = None
         self.repository = None
         self.host_path = None
         self.GitBase = None
         self.gitlocal = None
-
-        self.months = {
-            'Jan': 1,
-            'Feb': 2,
-            'Mar': 3,
-            'Apr': 4,
-            'May': 5,
-            'Jun': 6,
-            'Jul': 7,
-            'Aug': 8,
-            'Sep': 9,
-            'Oct': 10,
-            'Nov': 11,
-            'Dec': 12
-        }
+        self.target = None          # named group of hosts to deploy to.
+        self.state_lock = threading.Lock()   # for files threads share.
+        self.rsyncs = {}            # (host, path, project): rsync, to share.
+        self.rsyncs_lock = threading.Lock()
+        self.registry = Project_registry(self.logger)
 
         self.files = ['*.xml',
                       '*.html',
@@ -147,9 +276,6 @@ class PM(applicationCore):
                       '*.sas7bdat'
                       ]
 
-        self.sas_command = 'slt'
-        #self.remote_setup = ". ~/.profile;. ~/.zshrc;"
-        self.remote_setup = ". ~/.zshrc; sdsenv ;"
 
     def set_file(self, current_directory):
         """If a file name was given get it's relative path within the project"""
@@ -170,9 +296,64 @@ class PM(applicationCore):
         # make everything easier to get to.
         self.host = self.pconfig['devHost']
         self.host_path = self.pconfig['devPath']
+        if 'target' in self.args:
+            self.target = self.args.target
         self.directories = self.pconfig['directories']
         self.repository = self.pconfig['repository'] or 'local'
 
+    def target_hosts(self, target):
+        """The hosts and paths in a target group. A group is defined in the
+        project section by <target>Host or a list of hosts in <target>Hosts,
+        and <target>Path. A host in the list can have its own path,
+        host:/some/path."""
+        hosts = self.pconfig.get('%sHosts' % target) or self.pconfig.get('%sHost' % target)
+        path = self.pconfig.get('%sPath' % target) or self.host_path
+        if not hosts:
+            raise apperror("No hosts defined for target %s in project %s" %
+                           (target, self.name))
+
+        targets = []
+        for host in hosts.split(','):
+            host = host.strip()
+            if not host:
+                continue
+            if ':' in host:
+                host, host_path = host.split(':', 1)
+            else:
+                host_path = path
+            targets.append((host, host_path))
+        return targets
+
+    def target_rsyncs(self, target):
+        """An rsync for each host in the target, None for the hosts we
+        can't reach. The hosts are all probed at once."""
+        from rsync import connection
+        hosts = self.target_hosts(target)
+        reachable = connection(self.logger, int(self.ARGS.get('sshport', 22))
+                               ).check_connections([host for host, path in hosts])
+        return [(host, path,
+                 self.make_rsync(host, path, check=False) if reachable[host] else None)
+                for host, path in hosts]
+
+    def make_rsync(self, host, host_path, check=True):
+        """An rsync for this project and one host. Each is only made once,
+        and shared by every command in a batch."""
+        from rsync import rsync
+        delete = bool(self.ARGS.get('delete_missing')) or self.flag('deleteMissing')
+        key = (host, host_path, self.abs_project_path, delete)
+        with self.rsyncs_lock:
+            if key not in self.rsyncs:
+                self.rsyncs[key] = rsync(self.cmd, self.logger,
+                                         host_path, host,
+                                         self.abs_project_path,
+                                         self.excludes,
+                                         self.ARGS.get('parallelism', 1),
+                                         int(self.ARGS.get('sshport', 22)),
+                                         check,
+                                         self.ARGS,
+                                         delete)
+            return self.rsyncs[key]
+
     def set_local_git(self, project_base):
         """ setup the local git repository settings."""
         gitbase = self.config['default']['GitBase'] or None
@@ -186,15 +367,31 @@ class PM(applicationCore):
         self.local_repository = os.path.join(self.local_git, ('%s.git' % self.name))
 
     def setup_excludes(self):
-        try:
-            # Get it from the default section.
-            self.excludes = self.config['default']['excludes']
-            self.excludes.append = self.pconfig['excludes']
-        except:
-            try:
-                self.excludes = self.pconfig['excludes'] or None
-            except:
-                self.excludes = None
+        """Merge the built in, [default] and project excludes into the one
+        filter everything uses."""
+        from rsync.excludes import exclude_filter, builtin_excludes
+        self._excludes = exclude_filter(builtin_excludes,
+                                        self.config['default'].get('excludes'),
+                                        self.pconfig.get('excludes'))
+        return self._excludes
+
+    @property
+    def excludes(self):
+        """The excludes, merged the first time something asks."""
+        if self._excludes is None:
+            self.setup_excludes()
+        return self._excludes
+
+    @property
+    def rsync(self):
+        """The rsync for the project's host. Made, and the host checked,
+        the first time a command needs it, so commands that don't
+        transfer anything never touch the host."""
+        if self._rsync is None:
+            # a target deploy makes its own, one per host.
+            self._rsync = self.make_rsync(self.host, self.host_path,
+                                          check=self.target is None)
+        return self._rsync
 
     def set_opencmd(self):
         try:
@@ -206,31 +403,47 @@ class PM(applicationCore):
             except:
                 self.open_command = None
 
-    def find_project_root(self):
-        """Find the top of the project tree"""
-        while (os.path.abspath(self.project_root) != os.path.abspath('')
-               and os.path.abspath('') != os.path.abspath('/')):
+    def find_project_root(self, directory):
+        """Find the top of the project tree, from directory up. Without
+        changing directory, several of us can be looking at once."""
+        current = os.path.abspath(directory)
+        while (os.path.abspath(self.project_root) != current
+               and current != os.path.abspath('/')):
 
-            if os.path.isfile(__project_config_file__):
-                self.abs_project_path = os.path.abspath('')
+            if os.path.isfile(os.path.join(current, __project_config_file__)):
+                self.abs_project_path = current
                 return
             else:
-                os.chdir('..')
+                current = os.path.dirname(current)
 
         self.logger.error("This is not a valid PM project.")
         raise Exception
 
     def find_working_project(self):
         if self.name is None:
+            start = self.cwd or os.getcwd()
             if (self.directory):
-                os.chdir(os.path.join(self.project_root, self.directory))
+                start = os.path.join(self.project_root, self.directory)
+
+            # the registry knows where most projects are.
+            path, entry = self.registry.lookup(start)
+            if entry is not None:
+                self.logger.debug("Registered root %s" % path)
+                self.abs_project_path = path
+                self.name = entry['section']
+                return
+
             #find the top of the current project and get the name from
             # the projects rc file.  Set the project abs path while we are at it.
-            self.find_project_root()
+            self.find_project_root(start)
             if self.abs_project_path is not None:
                 self.logger.debug("Found root %s" % self.abs_project_path)
-                self.project_config = Project_config(self.abs_project_path)
+                self.project_config = Project_config(self.abs_project_path,
+                                                     logger=self.logger,
+                                                     cache=self.config_cache)
                 self.name = self.project_config.name
+                # next time we'll know.
+                self.registry.register(self.abs_project_path, self.name)
             else:
                 raise apperror("This is not a valid project directory")
         else:
@@ -241,7 +454,26 @@ class PM(applicationCore):
     or from a remote host. Upload, download, get results, run remote test, etc."""
 
     def delete(self):
-        pass
+        """Forget the project instance. The directory itself is left for
+        you to remove."""
+        self.registry.unregister(self.abs_project_path)
+        self.logger.info("Forgot %s, the directory is still there" %
+                         self.abs_project_path)
+
+    def set_project_root(self):
+        """Where all the projects go, ProjectRoot under ProjectBase."""
+        self.project_root = os.path.join(self.config['default']['ProjectBase'],
+                                         self.config['default']['ProjectRoot'])
+        return self.project_root
+
+    def reindex(self):
+        """Find every project instance under ProjectRoot, again."""
+        project_root = self.set_project_root()
+        found = self.registry.reindex(project_root, self.config_cache)
+        self.logger.info("%d project instances under %s" % (len(found), project_root))
+        for path in sorted(found):
+            self.logger.info("  %-20s %s" % (found[path]['name'], path))
+        return 0
 
     def new(self):
         """make project directory download or checkout source"""
@@ -264,36 +496,147 @@ class PM(applicationCore):
     def make_pconfig(self):
             self.project_config = Project_config(
                 self.abs_project_path, self.name, logger=self.logger)
+            self.registry.register(self.abs_project_path, self.name)
 
     def send(self, minimum=None):
-        """Update to a remote host"""
+        """Update to a remote host, or every host in the target"""
+        if self.target is not None:
+            return self.send_target(self.target)
+        return self.send_to(self.rsync, self.host, self.host_path)
+
+    def send_to(self, sync, host, host_path):
+        """Update one host with its own rsync"""
         if self.file is not None:
-            self.rsync.send_file(self.file)
+            return sync.send_file(self.file)
+        elif self.repository == 'local' and not self.flag('full'):
+            return self.send_changes(sync, host, host_path)
+        else:
+            return sync.send_all(self.directories, self.files)
+
+    def send_changes(self, sync, host, host_path):
+        """Deploy only what changed since our last deploy to this host,
+        according to the project's manifest."""
+        from rsync import manifest
+        deployed = manifest(self.abs_project_path,
+                            '%s:%s' % (host, host_path),
+                            sync.excludes, self.logger,
+                            hashing=self.flag('manifestHash'))
+
+        changes = deployed.changes(sync.plan(self.directories, self.files))
+        if changes is None:
+            # never been here before, send it all.
+            result = sync.send_all(self.directories, self.files)
         else:
-            self.rsync.send_directories(self.directories)
-            self.rsync.send_files(self.files)
+            result = sync.send_paths(*changes)
+
+        if not result.status and not self.cmd.no_execute:
+            # every host shares the one manifest file.
+            with self.state_lock:
+                deployed.commit()
+        return result
+
+    def send_target(self, target):
+        """Deploy to every host in a target group at the same time, at most
+        targetParallelism at once, and finish with a summary."""
+        from concurrent.futures import ThreadPoolExecutor
+        from rsync import transfer_result
+        hosts = self.target_rsyncs(target)
+
+        def deploy(host_path_sync):
+            host, path, sync = host_path_sync
+            # a host can be in a target more than once, with other paths.
+            label = '%s:%s' % (host, path)
+            if sync is None:
+                return label, transfer_result(label, 'unreachable')
+            try:
+                result = self.send_to(sync, host, path)
+            except Exception as e:
+                self.logger.error("%s: %s" % (label, e))
+                result = transfer_result(label, 'error')
+            if result is None:
+                result = transfer_result(label, 'no file')
+            return label, result
+
+        limit = int(self.ARGS.get('targetparallelism') or 8)
+        with ThreadPoolExecutor(max_workers=max(1, min(limit, len(hosts)))) as pool:
+            results = list(pool.map(deploy, hosts))
+
+        failures = 0
+        total = transfer_result(target)
+        self.logger.info("Deployed %s to target %s:" % (self.name, target))
+        for label, result in results:
+            if result.status:
+                failures += 1
+            self.logger.info("  %-40s %-12s %12d bytes %8.2fs" %
+                             (label,
+                              'failed (%s)' % result.status if result.status else 'ok',
+                              result.transferred, result.wall_time))
+            total.add(result)
+        if failures:
+            # total has the first failure's status, our exit status.
+            self.logger.error("%d of %d hosts failed" % (failures, len(results)))
+        return total
+
+    def watch(self):
+        """Watch the project and deploy changes as they happen, in
+        batches, until interrupted."""
+        from rsync import watcher, manifest
+        plan = self.rsync.plan(self.directories, self.files)
+        changes = watcher(self.abs_project_path, plan.excludes, self.logger,
+                          debounce=float(self.ARGS.get('debounce') or 1.0),
+                          polling=self.flag('poll'))
+        deployed = None
+        if self.repository == 'local':
+            # what we send goes in the manifest, so deploy doesn't send it again.
+            deployed = manifest(self.abs_project_path,
+                                '%s:%s' % (self.host, self.host_path),
+                                self.rsync.excludes, self.logger,
+                                hashing=self.flag('manifestHash'))
+        try:
+            for changed in changes.batches():
+                paths = []
+                deleted = []
+                for path in sorted(changed):
+                    if not plan.selects(path):
+                        continue
+                    if os.path.lexists(os.path.join(self.abs_project_path, path)):
+                        paths.append(path)
+                    else:
+                        deleted.append(path)
+                if not paths and not deleted:
+                    continue
+                # as they were when we sent them, a change after is the next batch's.
+                sent = deployed.stat(paths) if deployed is not None else {}
+                result = self.rsync.send_paths(paths, deleted)
+                if deployed is not None and not result.status and not self.cmd.no_execute:
+                    with self.state_lock:
+                        deployed.record(sent, deleted)
+        except KeyboardInterrupt:
+            self.logger.info("Done watching %s" % self.abs_project_path)
 
     def get(self, minimum=None):
         """populate or update from a remote host"""
         # If we have a remote repository, check stuff out.
         if self.repository != 'local':
-            self.clone()
+            result = self.clone()
         else:
             # Not a remote repository, unless we have one here.
             # if we have a local repository, check stuff out.
             if os.path.isdir(self.local_repository):
                 self.logger.info("Local repository: %s" % self.local_repository)
-                self.clone()
+                result = self.clone()
             else:
                 # no repository, download everything, and create a local remote
                 # git init --bare repository. After this we can just check stuff in and
                 # out and upload our changes to the server.
-                self.make()
-                self.rsync.get_directories(self.directories)
-                self.rsync.get_files(self.files)
+                # an instance we already have is updated where it is.
+                if not os.path.isdir(self.abs_project_path):
+                    self.make()
+                result = self.rsync.get_all(self.directories, self.files)
                 #self.setup_local_git()
         self.ctags()
         self.make_pconfig()
+        return result
 
     def setup_local_git(self):
         """ create a local git repository."""
@@ -304,122 +647,502 @@ class PM(applicationCore):
             else:
                 # create bare git repository to check stuff into.
                 os.mkdir(self.local_repository)
-                command = "git init --bare %s" % self.local_repository
-                self.cmd.run(command)
+                self.cmd.run(['git', 'init', '--bare', self.local_repository])
 
                 # initilize git in working project, push all to repository.
-                os.chdir(self.directory)
-                self.cmd.run('git init')   # .git in local dir.
-                self.cmd.run('git remote add origin %s' % self.local_repository)  # connect to remote repo
-                self.cmd.run('git add .')  # add everything
-                self.cmd.run('git commit -m "Initial import"')  # commit
-                self.cmd.run('git push')  # put it all into the remote repository.
+                here = self.abs_project_path
+                self.cmd.run(['git', 'init'], cwd=here)   # .git in local dir.
+                self.cmd.run(['git', 'remote', 'add', 'origin', self.local_repository],
+                             cwd=here)  # connect to remote repo
+                self.cmd.run(['git', 'add', '.'], cwd=here)  # add everything
+                self.cmd.run(['git', 'commit', '-m', 'Initial import'], cwd=here)  # commit
+                self.cmd.run(['git', 'push'], cwd=here)  # put it all into the remote repository.
 
     def clone(self):
-        """ get the project from it's git repository."""
+        """ get the project from it's git repository, or pull it if we
+        already have it."""
         # Going to need to check repository type if we want to support
         # something other than git.
-        os.chdir(self.project_root)
         if self.repository == 'local':
             if os.path.isdir(self.local_repository):
-                command = "git clone %s" % self.local_repository
+                repository = self.local_repository
             else:
                 raise  apperror('Sorry, no repository for this project')
         else:
-            command = "git clone %s" % self.repository
+            repository = self.repository
 
-        command = ('%s %s' % (command, self.directory))
-        self.cmd.run(command)
+        if os.path.isdir(os.path.join(self.abs_project_path, '.git')):
+            return self.cmd.run(['git', 'pull'], cwd=self.abs_project_path)
+        return self.cmd.run(['git', 'clone', repository, self.directory],
+                            cwd=self.project_root)
 
     def open(self):
         """ Open an IDE session on this project using the command given."""
         if self.open_command is not None:
-            command = '%s %s' % (self.open_command,
-                                 self.abs_project_path.replace(' ', '\ '))
-            self.cmd.run(command)
+            return self.cmd.run(shlex.split(self.open_command) + [self.abs_project_path])
         else:
             self.logger.info("""Sorry, no open command defined.
                         Add OpenCmd setting to config_file""")
 
     def ctags(self):
-        """ run ctags on the current project"""
-        os.chdir(self.abs_project_path)
-        self.cmd.run("/usr/local/bin/ctags -R .")
-
-    """These guys need some work. Mostly just stolen code from my SAS project
-    manager which isn't really valid here. But similar. So these  are placeholders
-    until I can get to them."""
-
-    def get_results(self):
-        """Get the most recent files from the the host"""
-        self.logger.info("Getting Results")
-        #ssh defender "ls -lt pp/s0265456"
-        base_time = None
-        files = []
-        sas_files = re.compile('\.sas', re.S)
-        for line in os.popen('ssh 10.16.2.246 "ls -lt %s"' % self.remote_directory):
-
-            # if it's not a directory entry we don't want it.
-            if len(line.split()) < 9:
-                continue
+        """ run ctags on the current project, on the files our excludes let
+        through, so ctags skips what rsync skips. Only the files that
+        changed since the last time are tagged again, unless --full."""
+        from ctags import tagger
+        tags = tagger(self.cmd, self.logger, self.abs_project_path, self.excludes,
+                      self.ARGS.get('ctagscmd'),
+                      jobs=self.ARGS.get('shards') or self.ARGS.get('ctagsjobs'))
+        return tags.update(full=self.flag('full'))
+
+    def tag(self):
+        """Look a symbol up in the project's tags file, or every registered
+        instance's, all at once. Prints file and address, or JSON."""
+        from ctags import find_tags
+        if self.args.all_instances:
+            instances = [(path, entry['name'])
+                         for path, entry in sorted(self.registry.load().items())]
+        else:
+            self.setup_project()
+            instances = [(self.abs_project_path, self.name)]
+
+        def lookup(instance):
+            path, name = instance
+            tags = find_tags(os.path.join(path, 'tags'), self.args.symbol,
+                             self.args.prefix)
+            for tag in tags:
+                tag['project'] = name
+                tag['path'] = os.path.join(path, tag['file'])
+            return tags
+
+        if len(instances) > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=min(32, len(instances))) as pool:
+                found = [tag for tags in pool.map(lookup, instances) for tag in tags]
+        else:
+            found = [tag for instance in instances for tag in lookup(instance)]
 
-            #print line.split()
-            month_name, day, time, name = line.split()[5:]
-            #print month_name, day, time, name
-            hour, minutes = time.split(':')
-            time_tuple = [datetime.datetime.now().year, self.months[month_name], int(day), int(hour), int(minutes), 0, 0, 1, 0]
-            #print time_tuple
-            epoch_time = datetime.datetime(time_tuple)
-
-            # the first file.
-            if not base_time:
-                base_time = epoch_time
-                files.append(name)
-            else:
-                # get all the files that have a date within a minute
-                # of the first one.
-                if base_time - epoch_time < 90:
-                    if not sas_files.search(name):
-                        files.append(name)
-                else:
-                    # bail once a file is too old
-                    break
+        if self.args.json:
+            import json
+            print(json.dumps(found, indent=1))
+        else:
+            for tag in found:
+                print('%s\t%s\t%s' % (tag['name'],
+                                       tag['path'] if self.args.all_instances else tag['file'],
+                                       tag['address']))
+        return 0 if found else 1
+
+    """Remote runs and their results. These started as code from my SAS project
+    manager, run_sas, run_and_get and get_results. Now any command can be run
+    on any number of hosts and the results come back when it's done."""
+
+    def results(self):
+        """Get the newest files from the host."""
+        return self.harvest(self.rsync, self.host, self.host_path)
+
+    def harvest(self, sync, host, host_path):
+        """Get the newest files from a host. One remote listing with exact
+        times and sizes is read as a stream, and the files within
+        resultsWindow seconds of the newest one, or with --since-last,
+        everything newer than our last harvest, come down in one rsync."""
+        import json
+        from rsync import exclude_filter, transfer_result
+        self.logger.info("Getting Results from %s" % host)
+        window = float(self.ARGS.get('window') or
+                       self.ARGS.get('resultswindow') or 90)
+        ignore = exclude_filter(sync.filter, self.ARGS.get('resultsignore'))
+
+        host_key = '%s:%s' % (host, host_path)
+        since = self.load_markers().get(host_key) if self.flag('since_last') else None
+
+        # since the last harvest is a simple filter. Otherwise keep a heap of
+        # what's within the window of the newest file seen so far.
+        newest = since or 0
+        selected = []
+        listing = self.cmd.lines(sync.remote_command("find . -type f -printf '%T@ %s %P\\n'"),
+                                 doitanyway=True)
+        for line in listing:
+            try:
+                mtime, size, path = line.rstrip('\n').split(' ', 2)
+                mtime = float(mtime)
+            except ValueError:
+                continue
+            if ignore.excluded_path(path):
+                continue
 
-        self.get_files(files)
+            if since is not None:
+                if mtime > since:
+                    selected.append((mtime, path))
+                    newest = max(newest, mtime)
+                continue
 
-    def run_sas(self, program='test.sas'):
-        """run batch sas with a program on a remote host"""
-        # ". ~/.zlogin;. ~/.zshrc; cd ~/pp/s0265456; slt t11"
-        remote_sas_command = "ssh %s '%s cd %s" % (self.remote_host, self.remote_setup, self.remote_directory)
-        remote_sas_command += "; %s %s'" % (self.sas_command, program)
-        os.system(remote_sas_command)
+            if mtime > newest:
+                newest = mtime
+                while selected and selected[0][0] < newest - window:
+                    heapq.heappop(selected)
+            if mtime >= newest - window:
+                heapq.heappush(selected, (mtime, path))
+
+        if listing.result.status:
+            self.logger.error("Could not list the files on %s: %s" % (host, listing.result))
+            return transfer_result(host, listing.result.status)
+
+        self.logger.info("%d result files" % len(selected))
+        result = sync.get_paths(sorted(path for mtime, path in selected))
+
+        if selected and not result.status and not self.cmd.no_execute:
+            with self.state_lock:
+                markers = self.load_markers()
+                markers[host_key] = newest
+                with open(os.path.join(self.abs_project_path, __results_file__), 'w') as f:
+                    json.dump(markers, f)
+        return result
+
+    def load_markers(self):
+        """The newest result we've harvested from each host."""
+        import json
+        try:
+            with open(os.path.join(self.abs_project_path, __results_file__)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def run_remote(self):
+        """Run a command in the project's remote path, on each host of the
+        target and in each directory given, several at a time. Output comes
+        back a line at a time as it happens, and each job's results are
+        downloaded as soon as it finishes."""
+        from concurrent.futures import ThreadPoolExecutor
+        from rsync import remote_job
+        from rsync.jobs import with_timeout
+        from rsync.rsync import quote_path
+        # the command given is arguments, RunCmd and remoteSetup are shell.
+        command = ' '.join(shlex.quote(arg) for arg in self.args.command or [])
+        run_cmd = self.ARGS.get('runcmd')
+        if run_cmd:
+            command = ('%s %s' % (run_cmd, command)).strip()
+        if not command:
+            raise apperror("Nothing to run. Give a command or set RunCmd.")
+        setup = self.ARGS.get('remotesetup')
+        if setup:
+            command = '%s; %s' % (setup.rstrip('; '), command)
+
+        if self.target is not None:
+            hosts = self.target_rsyncs(self.target)
+        else:
+            hosts = [(self.host, self.host_path, self.rsync)]
+        timeout = float(self.ARGS.get('timeout') or self.ARGS.get('runtimeout') or 0)
+
+        jobs = []
+        for host, path, sync in hosts:
+            for directory in self.args.cd or ['.']:
+                name = '%s:%s' % (host, directory)
+                if sync is None:
+                    jobs.append((name, None, host, path, None))
+                    continue
+                job_command = 'cd %s && %s' % (quote_path(directory), command)
+                if timeout:
+                    # stopped on the host, not just our ssh.
+                    job_command = with_timeout(job_command, timeout)
+                job = remote_job(name, sync.remote_command(job_command),
+                                 self.logger, timeout or None, self.cmd.no_execute)
+                jobs.append((name, job, host, path, sync))
+
+        def run_job(job_entry):
+            name, job, host, path, sync = job_entry
+            if job is None:
+                return name, 'unreachable'
+            status = job.run()
+            if status == 0 and not self.args.no_results:
+                self.harvest(sync, host, path)
+            return name, status
+
+        limit = int(self.ARGS.get('jobs') or self.ARGS.get('runjobs') or len(jobs))
+        with ThreadPoolExecutor(max_workers=max(1, min(limit, len(jobs)))) as pool:
+            statuses = list(pool.map(run_job, jobs))
+
+        failures = [name for name, status in statuses if status]
+        for name, status in statuses:
+            self.logger.info("  %-40s %s" % (name, 'ok' if not status else
+                                             'failed (%s)' % status))
+        if failures:
+            self.logger.error("%d of %d jobs failed" % (len(failures), len(statuses)))
+            return 1
+        return 0
+
+    @contextmanager
+    def project_lock(self):
+        """Hold the project's lock while a command runs, so two PMs, or two
+        requests to the daemon, don't deploy or fetch the same project at
+        the same time. watch and open share."""
+        if 'shared' in self.args or fcntl is None or self.name is None:
+            yield
+            return
+        lock_dir = os.path.join(os.getenv('HOME') or '/tmp', '.PMlocks')
+        os.makedirs(lock_dir, exist_ok=True)
+        with open(os.path.join(lock_dir, '%s.lock' % self.name), 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self.logger.info("Waiting for another PM working on %s" % self.name)
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def daemon(self):
+        """Serve PM commands from one warm process until stopped. The
+        config, every module and the ssh masters stay loaded between
+        commands."""
+        from application import client
+        if self.args.stop or self.args.status:
+            status = client.request(__application__,
+                                    {'command': 'stop' if self.args.stop else 'status'})
+            if status is None:
+                self.logger.info("No %s daemon is running" % __application__)
+            return status
+
+        import importlib
+        from application.daemon import appdaemon
+        # everything imported once, here, instead of in every command.
+        importlib.import_module('rsync')
+        masters = importlib.import_module('rsync.sshmaster')
+        masters.default_persist = self.ARGS.get('sshpersist') or '10m'
+        masters.get_socket_dir()
+
+        appdaemon(__application__, PM, self.logger).serve()
+        return 0
+
+    def cleanup(self):
+        """Put away the ssh masters too, if we've used any."""
+        super().cleanup()
+        masters = sys.modules.get('rsync.sshmaster')
+        if masters is not None:
+            masters.close_all()
+
+    def subcommand(self, argv, cwd=None):
+        """Another PM for a batch, sharing our rsyncs and locks too."""
+        child = super().subcommand(argv, cwd)
+        child.rsyncs = self.rsyncs
+        child.rsyncs_lock = self.rsyncs_lock
+        child.state_lock = self.state_lock
+        child.registry = self.registry
+        return child
+
+    def read_batch(self, script):
+        """The commands in a batch script, [(line, argv, cwd)]. A line is a
+        PM command line, with or without the PM, a JSON list of arguments,
+        or a JSON object with argv, or command, and cwd. Blank lines and
+        # comments are skipped."""
+        import json
+        if script == '-':
+            lines = sys.stdin.read().splitlines()
+        else:
+            with open(script) as f:
+                lines = f.read().splitlines()
 
-    def run_and_get(self, program='test.sas'):
-        """run batch sas remotely and get the results back"""
-        self.run_sas(program)
-        self.get_results()
+        commands = []
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            cwd = None
+            try:
+                if line[0] in '[{':
+                    entry = json.loads(line)
+                    if isinstance(entry, dict):
+                        cwd = entry.get('cwd')
+                        argv = entry.get('argv') or shlex.split(entry.get('command', ''))
+                    else:
+                        argv = entry
+                else:
+                    argv = shlex.split(line)
+            except ValueError as e:
+                self.logger.error("Can't read batch line %s: %s" % (line, e))
+                argv = None
+            if argv and os.path.basename(str(argv[0])) in (__application__, 'PM.py'):
+                argv = argv[1:]
+            commands.append((line, [str(arg) for arg in argv or []], cwd))
+        return commands
+
+    def batch(self):
+        """Run a script of PM commands in this process. The config is read
+        once, and the commands share our syscall, rsyncs and ssh masters.
+        Each command line is parsed first, then they run, --jobs at a time.
+        Anything but daemon and batch can be in one."""
+        entries = []
+        for line, argv, cwd in self.read_batch(self.args.script):
+            child = None
+            try:
+                child = self.subcommand(argv, cwd)
+                if ('func' not in child.args or
+                        child.args.func.__name__ in __local_commands__):
+                    self.logger.error("%s: can't be run in a batch" % line)
+                    child = None
+            except SystemExit:
+                # argparse has already said what was wrong.
+                pass
+            except Exception as e:
+                self.logger.error("%s: %s" % (line, e))
+            entries.append((line, child))
+
+        jobs = int(self.args.jobs or self.ARGS.get('batchjobs') or 1)
+        return self.run_children("Batch %s" % self.args.script, entries, jobs)
+
+    def run_children(self, title, entries, jobs):
+        """Run the commands made by subcommand, [(label, child)], jobs at a
+        time. A child of None is a command that couldn't be made. A failure
+        doesn't stop the rest, and a table of how each went comes at the
+        end. Returns 1, our exit status, if any of them failed."""
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+
+        def run(entry):
+            label, child = entry
+            if child is None:
+                return label, 'bad command', 0.0
+            start = time.time()
+            try:
+                status = self.result_status(child.dispatch())
+            except Exception as e:
+                self.logger.error("%s: %s" % (label, e))
+                status = 'error'
+            return label, status, time.time() - start
+
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+            results = list(pool.map(run, entries))
+
+        failures = 0
+        self.logger.info("%s:" % title)
+        for label, status, seconds in results:
+            if status:
+                failures += 1
+            self.logger.info("  %-50s %-16s %8.2fs" %
+                             (label, 'failed (%s)' % status if status else 'ok', seconds))
+        self.logger.info("%d ok, %d failed, in %.2fs" %
+                         (len(results) - failures, failures, time.time() - start))
+        if failures:
+            self.logger.error("%d of %d commands failed" % (failures, len(results)))
+            return 1
+        return 0
+
+    def bulk_instances(self):
+        """The project instances picked by --all, --tag and the directories
+        given, [(path, label)], each once. The label is the path under
+        ProjectRoot, so two instances of a project can be told apart. A
+        directory is under ProjectRoot, like -d, unless it's an absolute
+        path."""
+        from rsync.planner import split_list
+        instances = self.registry.load()
+        if self.args.all and not instances:
+            self.registry.reindex(self.project_root, self.config_cache)
+            instances = self.registry.load()
+
+        selected = OrderedDict()
+        tags = set(self.args.tag or [])
+        for path in sorted(instances):
+            section = instances[path]['section']
+            if self.args.all or tags.intersection(
+                    split_list(self.config.get(section, 'tags', fallback=None))):
+                selected[path] = None
+
+        for directory in self.args.instances or []:
+            selected[os.path.abspath(os.path.join(self.project_root, directory))] = None
+
+        root = os.path.abspath(self.project_root)
+        return [(path, os.path.relpath(path, root)
+                 if path.startswith(root + os.sep) else path)
+                for path in selected]
+
+    def bulk(self):
+        """Run our command on many project instances, --jobs at a time.
+        Each gets its own PM, and so its own rsyncs, and everything it logs
+        starts with where it is."""
+        self.set_project_root()
+        instances = self.bulk_instances()
+        if not instances:
+            raise apperror("No project instances picked, check --tag and the registry")
+
+        skip = ('func', 'bulk', 'all', 'tag', 'instances', 'jobs')
+        entries = []
+        for path, label in instances:
+            child = None
+            try:
+                child = self.subcommand([self.args.bulk], cwd=path)
+                child.logger = project_logger(self.logger, {'project': label})
+                for key, value in vars(self.args).items():
+                    if key not in skip:
+                        setattr(child.args, key, value)
+                        child.ARGS[key] = value
+            except (SystemExit, Exception) as e:
+                self.logger.error("%s: %s" % (label, e))
+            entries.append((label, child))
+
+        jobs = int(self.args.jobs or self.ARGS.get('bulkjobs') or 4)
+        return self.run_children("%s of %d projects" % (self.args.bulk, len(entries)),
+                                 entries, jobs)
 
     def checkout_source(self):
         if self.directory:
-            if not self.noex:
-                os.system(("cvs -z2 co -r %s %s_src" %
-                           (self.track_tls, self.directory)))
-            else:
-                print ("No execute: cvs -z2 co -r %s %s_src" %
-                       (self.track_tls, self.directory))
+            directories = [self.directory]
         else:
-            for directory in self.__class__.directories:
-                if not self.noex:
-                    os.system(("cvs -z2 co -r %s %s_src" %
-                               (self.track_tls, directory)))
-                else:
-                    print ("No execute: cvs -z2 co -r %s %s_src" %
-                           (self.track_tls, directory))
+            directories = self.__class__.directories
+        # all of them at once.
+        return self.cmd.gather([self.cmd.submit(['cvs', '-z2', 'co', '-r', self.track_tls,
+                                                 '%s_src' % directory])
+                                for directory in directories])
+
     """This is where we setup the commandline arguments for the ApplicationCore
     class. application core handles help, verbosity, config file, quiet,
     no execute. Maybe more. This class uses subparsers to create commands.
     Each subparser has a default function that is called automatically later on.
     """
+    def commands(self):
+        """The sub commands, in the order help shows them. Each has its help
+        and the method that adds the rest of its arguments."""
+        return OrderedDict([
+            ('ctags', ("""Run ctags on current project or specified directory""",
+                       self.ctags_arguments)),
+            ('download', ("""Get project or file from server.
+                          defaults to an update of the current project""",
+                          self.download_arguments)),
+            ('deploy', (""""Upload project or file
+                        to server. Defaults to an upload of the current project""",
+                        self.deploy_arguments)),
+            ('watch', ("""Watch the project and deploy
+                       changes to the server as they happen""",
+                       self.watch_arguments)),
+            ('results', ("""Download the newest files
+                         from the server, results of the last run.""",
+                         self.results_arguments)),
+            ('run', ("""Run a command in the project's
+                     path on the server, RunCmd followed by any
+                     arguments given, and download the results.""",
+                     self.run_arguments)),
+            ('new', ("""New Project, if project exists creates
+                     a working instance of that project in the projects
+                     directory using the project name or the directory name
+                     given""",
+                     self.new_arguments)),
+            ('delete', ("""Delete Project instance.
+                        Tries to delete current project, or project
+                        given by the -d option""",
+                        self.delete_arguments)),
+            ('open', ("""Open Project directory with shell
+                      command as specified by OpenCmd in
+                      the config file""",
+                      self.open_arguments)),
+            ('daemon', ("""Keep PM loaded and warm, and run every
+                        PM command given while it's up""",
+                        self.daemon_arguments)),
+            ('batch', ("""Run PM command lines from a file, or
+                       stdin, in this one process""",
+                       self.batch_arguments)),
+            ('reindex', ("""Find every project instance under
+                         ProjectRoot and remember where they are""",
+                         self.reindex_arguments)),
+            ('tag', ("""Look a symbol up in the project's tags
+                     file, or every project's""",
+                     self.tag_arguments))])
+
     def argument_setup(self):
 
         #Create the sub parsers for each command
@@ -427,58 +1150,168 @@ class PM(applicationCore):
         #                              help='execute command on current project')
         subparsers = self.main_parser.add_subparsers(help='sub-command help')
 
-        # create the parser for the "ctags" command
-        parser = subparsers.add_parser('ctags',
-                                       help="""Run ctags on current project or specified directory""")
+        # Every command is listed for help, but only the one on the command
+        # line gets the rest of its arguments built.
+        given = set(self.remaining_argv or [])
+        for name, (help, arguments) in self.commands().items():
+            parser = subparsers.add_parser(name, help=help)
+            if name in given:
+                arguments(parser)
+
+    def ctags_arguments(self, parser):
+        # the arguments for the "ctags" command
         parser.add_argument('-d', '--directory',
                             help='Run ctags on this directory instead of project')
+        parser.add_argument('--full', action='store_true',
+                            help="""Tag everything, not just what changed since
+                            the last time.""")
+        parser.add_argument('--shards', type=int,
+                            help="""Split the files into this many ctags runs at
+                            once. Defaults to CtagsJobs or one per cpu.""")
+        self.bulk_arguments(parser, 'ctags')
         parser.set_defaults(func=self.ctags)
 
-        # create the parser for the "get" command
-        parser = subparsers.add_parser('download', help="""Get project or file from server.
-                                       defaults to an update of the current project""")
+    def download_arguments(self, parser):
+        # the arguments for the "get" command
         parser.add_argument('-p', '--project', help='download project into current directory')
         parser.add_argument('-f', '--file', help='download file.')
+        self.bulk_arguments(parser, 'download')
         parser.set_defaults(func=self.get)
 
-        # create the parser for the "put" command
-        parser = subparsers.add_parser('deploy', help=""""Upload project or file
-                                       to server. Defaults to an upload of the current project""")
+    def deploy_arguments(self, parser):
+        # the arguments for the "put" command
         parser.add_argument('-f', '--file', help='download file.')
         parser.add_argument('-d', '--directory',
                             help="""Directory name of project to upload.
                             Must be a valid project directory.""")
+        parser.add_argument('-t', '--target',
+                            help="""Deploy to every host in this target group,
+                            dev, prod, or any group defined in the project.""")
+        parser.add_argument('--full', action='store_true',
+                            help="""Send everything, not just what changed since
+                            the last deploy.""")
+        parser.add_argument('--delete', dest='delete_missing', action='store_true',
+                            help="""Delete files on the host that are gone here.
+                            Defaults to DeleteMissing, no.""")
+        self.bulk_arguments(parser, 'deploy')
         parser.set_defaults(func=self.send)
 
-        # create the parser for the "new" command, this either creates a new
+    def bulk_arguments(self, parser, command):
+        # the arguments for running a command on many projects at once.
+        parser.add_argument('instances', nargs='*',
+                            help="""Project instance directories to work on,
+                            instead of the current project.""")
+        parser.add_argument('--all', action='store_true',
+                            help='Every registered project instance.')
+        parser.add_argument('--tag', action='append',
+                            help="""Every project instance whose section has this
+                            in its Tags. Give it more than once for more.""")
+        parser.add_argument('-j', '--jobs', type=int,
+                            help="""How many projects to work on at once.
+                            Defaults to BulkJobs or 4.""")
+        parser.set_defaults(bulk=command)
+
+    def watch_arguments(self, parser):
+        # the arguments for the "watch" command
+        parser.add_argument('-d', '--directory',
+                            help="""Directory name of project to watch.
+                            Must be a valid project directory.""")
+        parser.add_argument('--debounce', type=float,
+                            help="""Seconds of quiet to wait for before sending
+                            a batch of changes. Defaults to 1.""")
+        parser.add_argument('--poll', action='store_true',
+                            help='Poll for changes instead of using inotify.')
+        parser.add_argument('--delete', dest='delete_missing', action='store_true',
+                            help="""Delete files on the host that are deleted here.
+                            Defaults to DeleteMissing, no.""")
+        parser.set_defaults(func=self.watch, shared=True)
+
+    def results_arguments(self, parser):
+        # the arguments for the "results" command
+        parser.add_argument('-d', '--directory',
+                            help="""Directory name of project to get results for.
+                            Must be a valid project directory.""")
+        parser.add_argument('-w', '--window', type=float,
+                            help="""Get files within this many seconds of the
+                            newest. Defaults to resultsWindow or 90.""")
+        parser.add_argument('-s', '--since-last', action='store_true',
+                            help='Get everything newer than the last results.')
+        parser.set_defaults(func=self.results)
+
+    def run_arguments(self, parser):
+        # the arguments for the "run" command
+        parser.add_argument('-d', '--directory',
+                            help="""Directory name of project to run in.
+                            Must be a valid project directory.""")
+        parser.add_argument('-t', '--target',
+                            help='Run on every host in this target group.')
+        parser.add_argument('-C', '--cd', action='append',
+                            help="""Run in this directory under the remote path.
+                            Give it more than once to run in several.""")
+        parser.add_argument('-j', '--jobs', type=int,
+                            help='How many jobs to run at once. Defaults to all of them.')
+        parser.add_argument('--timeout', type=float,
+                            help='Give up on a job after this many seconds.')
+        parser.add_argument('--no-results', action='store_true',
+                            help="Don't download results when a job finishes.")
+        parser.add_argument('command', nargs=argparse.REMAINDER,
+                            help='Command, or arguments to RunCmd, to run.')
+        parser.set_defaults(func=self.run_remote)
+
+    def new_arguments(self, parser):
+        # the arguments for the "new" command, this either creates a new
         # config section or creates the project directory and gets the source
         # code.
-        parser = subparsers.add_parser('new', help="""New Project, if project exists creates
-                                       a working instance of that project in the projects
-                                       directory using the project name or the directory name
-                                       given""")
         parser.add_argument('new', help='Name of Project to create')
         parser.add_argument('-d', '--directory', help="""Name of Directory to put project in.
                             Defaults to Project name.""")
         parser.set_defaults(func=self.new)
 
-        # create the parser for the "Delete" command
-        parser = subparsers.add_parser('delete', help="""Delete Project instance.
-                                       Tries to delete current project, or project
-                                       given by the -d option""")
+    def delete_arguments(self, parser):
+        # the arguments for the "Delete" command
         parser.add_argument('-d', '--directory',
                             help="""Name of Directory to delete. Defaults to
                             Project name if currently inside project.""")
         parser.set_defaults(func=self.delete)
 
-        # create the parser for the "Open" command
-        parser = subparsers.add_parser('open',
-                                       help="""Open Project directory with shell
-                                       command as specified by OpenCmd in
-                                       the config file""")
+    def open_arguments(self, parser):
+        # the arguments for the "Open" command
         parser.add_argument('directory', help='Name of Project directory to open in IDE')
         #parser.add_argument('-t', '--type', help="""Type of project. Helps determine stuff""")
-        parser.set_defaults(func=self.open)
+        parser.set_defaults(func=self.open, shared=True)
+
+    def daemon_arguments(self, parser):
+        # the arguments for the "daemon" command
+        parser.add_argument('--stop', action='store_true',
+                            help='Stop the running daemon.')
+        parser.add_argument('--status', action='store_true',
+                            help='Say whether the daemon is running.')
+        parser.set_defaults(func=self.daemon, no_project=True)
+
+    def reindex_arguments(self, parser):
+        # the arguments for the "reindex" command
+        parser.set_defaults(func=self.reindex, no_project=True)
+
+    def tag_arguments(self, parser):
+        # the arguments for the "tag" command
+        parser.add_argument('symbol', help='Name of the symbol to look up.')
+        parser.add_argument('--prefix', action='store_true',
+                            help='Every symbol that starts with it.')
+        parser.add_argument('-a', '--all-instances', action='store_true',
+                            help='Look in every registered project instance.')
+        parser.add_argument('--json', action='store_true',
+                            help='Print the tags found as JSON.')
+        parser.set_defaults(func=self.tag, no_project=True)
+
+    def batch_arguments(self, parser):
+        # the arguments for the "batch" command
+        parser.add_argument('script', nargs='?', default='-',
+                            help="""File of PM command lines, one to a line,
+                            or - for stdin, the default.""")
+        parser.add_argument('-j', '--jobs', type=int,
+                            help="""How many commands to run at once.
+                            Defaults to BatchJobs or 1, one after the other.""")
+        parser.set_defaults(func=self.batch, no_project=True)
 
     def process(self):
         """Process the arguments, distribute the work. """
@@ -493,13 +1326,48 @@ class PM(applicationCore):
         # section. We can ask our super to merge the config section in as
         # soon as we know it's name.
 
+        return self.exit_status(self.dispatch())
+
+    def dispatch(self):
+        """Run the command we were given, on the project we're in, on many
+        projects, or on none. Batch commands come through here too."""
+        # some commands don't work on a project.
+        if 'no_project' in self.args:
+            return self.args.func()
+
+        # or work on many.
+        if 'bulk' in self.args and (self.args.all or self.args.tag or
+                                    self.args.instances):
+            return self.bulk()
+
+        self.setup_project()
+        return self.run_command()
+
+    @staticmethod
+    def result_status(result):
+        """What a command returned as a status, 0 when it went well.
+        Commands return an exit status, a callresult or transfer_result,
+        or nothing."""
+        if result is None:
+            return 0
+        if isinstance(result, int):
+            return result
+        return getattr(result, 'status', 0) or 0
+
+    def exit_status(self, result):
+        """What a command returned as an exit status for the shell, the
+        same whether we ran it or the daemon did."""
+        status = self.result_status(result)
+        return status if isinstance(status, int) else 1
+
+    def setup_project(self):
+        """Work out which project we're in, or were given, and load its
+        settings."""
         project_base = self.config['default']['ProjectBase']
-        project_root = self.config['default']['ProjectRoot']
-        self.project_root = os.path.join(project_base, project_root)
-        self.excludes = []
+        self.set_project_root()
 
         if 'file' in self.args:
-            current_directory = os.path.abspath('')
+            current_directory = self.cwd or os.getcwd()
             self.file = self.args.file
 
         if 'p' in self.args:
@@ -515,7 +1383,8 @@ class PM(applicationCore):
         else:
             self.directory = self.name
 
-        self.find_working_project()
+        with self.tracer.span('find_working_project'):
+            self.find_working_project()
 
         self.logger.debug('%s : %s' % (self.name, self.directory))
 
@@ -537,15 +1406,11 @@ class PM(applicationCore):
         #Get the open command if we have one.
         self.set_opencmd()
 
-        #get the excludes for the rsync.
-        self.setup_excludes()
-
-        # set up the rsync connection
-        self.rsync = rsync(self.cmd, self.logger,
-                           self.host_path, self.host,
-                           self.abs_project_path,
-                           self.excludes)
+        # The excludes and the rsync connection are set up the first time
+        # the command uses them.
 
+    def run_command(self):
+        """Run the command we were given, holding the project's lock."""
         # Need some debug for understanding???? Here it is.
         #self.logger.info(self.args)
         #self.logger.info(self.config)
@@ -559,11 +1424,12 @@ class PM(applicationCore):
         # surround it all with a try to handle errors nicely.
         #try:
         if 'func' in self.args:
-            self.args.func()
+            with self.project_lock():
+                return self.args.func()
         #    return 0
         #except Exception as e:
         #    self.logger.error(e)
         #    return 1
 
 if __name__ == "__main__":
-    PM().app_main()
+    sys.exit(PM().app_main())
@@ -1,7 +1,22 @@
 # outer __init__.py
-from application.application import applicationCore
-from application.application import apperror
-from application.application import syscall
-from application.application import applicationlogger
+# The application module, and argparse, configparser and logging with it,
+# is only imported when one of these is first asked for. That keeps
+# application.client, the daemon's thin client, quick to import on its own.
+import importlib
 
-__all__ = [applicationCore, apperror, syscall, applicationlogger]
+__exports__ = {'applicationCore': 'application.application',
+               'apperror': 'application.application',
+               'syscall': 'application.application',
+               'callresult': 'application.application',
+               'applicationlogger': 'application.application'}
+
+
+def __getattr__(name):
+    if name not in __exports__:
+        raise AttributeError("module 'application' has no attribute '%s'" % name)
+    value = getattr(importlib.import_module(__exports__[name]), name)
+    globals()[name] = value
+    return value
+
+
+__all__ = list(__exports__)
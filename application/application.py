@@ -15,20 +15,31 @@ __version__ = '$Revision: 1 $'[11:-2]
 
 no_execute = None   # so we can run and not do anything.
 
+# Only what every run needs is imported up here. subprocess, the thread
+# pool and the profiler are imported when they are first used, so --help
+# and the quick commands start fast.
 import os
+import sys
+import time
+import shlex
+import threading
 import configparser
 import argparse
 from collections import OrderedDict
 from application.applogger import applicationlogger
+from application.tracer import tracer
+from application.configcache import configcache
 
 
 class applicationCore():
 
     def __init__(self, prefix_chars='-', epilog=''):
 
+        self.tracer = tracer()
         self.applogger = applicationlogger()
         self.logger = self.applogger.get_logger()
-        self.cmd = syscall(self.logger)
+        self.cmd = syscall(self.logger, tracer=self.tracer)
+        self.config_cache = configcache(self.logger)
 
         self.prefix_chars = prefix_chars
         if  self.__doc__:
@@ -50,6 +61,8 @@ class applicationCore():
         self.arg_groups = OrderedDict()
 
         self.args = None
+        self.config_args = None
+        self.cwd = None     # where relative paths start, None for our own.
         # single layer list of same argument objects for easy lookup.
         self.ARGS = {}
 
@@ -64,6 +77,14 @@ class applicationCore():
                                   self.config_file),
                                   default=self.config_file)
 
+        # these are needed before anything else happens.
+        trace_p_group = self.conf_parser.add_argument_group('Tracing')
+        trace_p_group.add_argument('--trace', metavar='FILE',
+                                   help='Write a Chrome trace of where the time goes to FILE')
+        trace_p_group.add_argument('--profile', action='store_const', const=1,
+                                   default=None,
+                                   help='Profile the run and print the statistics')
+
     def create_parser(self):
         # create the top-level parser
         #  parents=[self.conf_parser],
@@ -104,6 +125,13 @@ class applicationCore():
         conf_m_group.add_argument('-ps', '--print_settings', action='store',
                                   help="Print section configuration settings.")
 
+        trace_m_group = self.main_parser.add_argument_group('Tracing')
+        trace_m_group.add_argument('--trace', metavar='FILE',
+                                   help='Write a Chrome trace of where the time goes to FILE')
+        trace_m_group.add_argument('--profile', action='store_const', const=1,
+                                   default=None,
+                                   help='Profile the run and print the statistics')
+
         self.argument_setup()
 
     # Set this up in the child class. This is where you add your arguments to
@@ -119,19 +147,25 @@ class applicationCore():
         The child uses process to do the work, look at the config entries and
         arguments do the actual proecessing."""
 
-        self.logger_setup()
-        self.parse_for_configuration()
+        with self.tracer.span('logger_setup'):
+            self.logger_setup()
+
+        if self.config_args is None:
+            self.parse_for_configuration()
 
         #print (vars(self.config_args))
 
         # load configuration.
-        self.load_settings()
+        with self.tracer.span('load_settings'):
+            self.load_settings()
 
         # This is delayed so we know what our section choices are.
-        self.create_parser()
+        with self.tracer.span('create_parser'):
+            self.create_parser()
 
         # parse the rest of the command line.
-        self.parse_for_rest()
+        with self.tracer.span('parse'):
+            self.parse_for_rest()
 
         # this is a global that anyone can check.
         self.cmd.no_execute = self.args.noex
@@ -151,6 +185,33 @@ class applicationCore():
         if 'config_section' in self.config_args:
             self.merge_section(self.config_args.config_section)
 
+    def subcommand(self, argv, cwd=None):
+        """A new instance of the application, ready to run one more
+        command line. It shares our config, logging, tracer and syscall, so
+        nothing is read or set up again, only argv is parsed. argparse
+        errors come out as SystemExit, like they always do."""
+        level = self.logger.level
+        child = self.__class__()
+        # making a logger resets the level on the one logger we all share.
+        self.logger.setLevel(level)
+
+        child.applogger = self.applogger
+        child.logger = self.logger
+        child.formatter = self.formatter
+        child.tracer = self.tracer
+        child.cmd = self.cmd
+        child.config_cache = self.config_cache
+        child.config = self.config
+        child.config_sections = self.config_sections
+        child.config_args = self.config_args
+        child.cwd = cwd or self.cwd
+        child.remaining_argv = list(argv)
+
+        child.create_parser()
+        child.parse_for_rest()
+        child.merge_args()
+        return child
+
     def merge_args(self):
         """Create a master list of default and commandline arguments."""
         self.applogger.info(self.config['default'])
@@ -171,6 +232,14 @@ class applicationCore():
         for k in args_dict:
             self.ARGS[k] = args_dict[k]
 
+    def flag(self, name, default=False):
+        """A yes/no, true/false, on/off, 1/0 setting from ARGS as a bool."""
+        value = self.ARGS.get(name.lower(), default)
+        if isinstance(value, str):
+            return configparser.ConfigParser.BOOLEAN_STATES.get(value.lower(),
+                                                                default)
+        return bool(value)
+
     def parse_for_configuration(self):
         """ get the default configuration file name or if someone passed it in"""
         self.config_args, self.remaining_argv = self.conf_parser.parse_known_args()
@@ -190,7 +259,12 @@ class applicationCore():
             self.applogger.quiet()
 
         if self.args.log:
-            self.applogger.logfile(self.args.log, self.formatter)
+            # LogMaxBytes and LogBackups in [default] control rotation.
+            self.applogger.logfile(self.args.log, self.formatter,
+                                   int(self.config.get('default', 'LogMaxBytes',
+                                                       fallback=10 * 1024 * 1024)),
+                                   int(self.config.get('default', 'LogBackups',
+                                                       fallback=3)))
 
         self.applogger.debug(vars(self.args))
         self.applogger.setLevel(self.args.verbose)
@@ -221,10 +295,9 @@ class applicationCore():
         # If we have a config file, load up the section indicated and set
         # defaults to it's result.
         if config_file:
-            self.config = configparser.SafeConfigParser()
-            if  os.path.isfile(config_file):
-                self.config.read([config_file])
-
+            # parsed once, then compiled and cached until the file changes.
+            self.config = self.config_cache.load(config_file)
+            if self.config is not None:
                 self.applogger.debug("Reading configuration file: %s" %
                                      (config_file))
 
@@ -235,6 +308,7 @@ class applicationCore():
                     self.config_sections.append(name)
 
             else:
+                self.config = configparser.SafeConfigParser()
                 # don't die if the default config file is missing.
                 if config_file != self.default_config:
                     self.applogger.error("Could not read configuration file %s" %
@@ -302,20 +376,226 @@ class applicationCore():
             with open(config_file, 'w') as fconfig_file:
                 config.write(fconfig_file)
 
+    def cleanup(self):
+        """Put away what we started. atexit does this on the way out, but a
+        process that leaves with os._exit, like a forked daemon request,
+        has to call it."""
+        self.cmd.shutdown()
+        self.applogger.flush()
+
     def app_main(self):
-        self.process()
+        self.parse_for_configuration()
+        try:
+            if self.config_args.profile:
+                return self.profile(self.process)
+            with self.tracer.span('app_main'):
+                return self.process()
+        finally:
+            self.save_trace()
+            # get everything into the log file before we go.
+            self.applogger.flush()
+
+    def profile(self, function):
+        """Run function under cProfile, print where the time went."""
+        import pstats
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            with self.tracer.span('app_main', profiled=True):
+                return profiler.runcall(function)
+        finally:
+            stats = pstats.Stats(profiler, stream=sys.stderr)
+            stats.sort_stats('cumulative').print_stats(30)
+
+    def save_trace(self):
+        """Write the trace if we were asked for one."""
+        if self.config_args is None or not self.config_args.trace:
+            return
+        try:
+            count = self.tracer.save(self.config_args.trace)
+            self.logger.debug("Wrote %d spans to %s" % (count, self.config_args.trace))
+        except (IOError, OSError) as e:
+            self.logger.error("Could not write trace %s: %s" % (self.config_args.trace, e))
+
+
+class callresult():
+    """ What happened when we ran a command. """
+
+    def __init__(self, command, returncode=0, duration=0.0, output=None,
+                 errors=None, timed_out=False):
+        self.command = command
+        self.returncode = returncode
+        self.duration = duration
+        self.output = output or ''
+        self.errors = errors or ''
+        self.timed_out = timed_out
+
+    @property
+    def status(self):
+        """The exit status, or 'timeout'. 0 is good, like the shell."""
+        if self.timed_out:
+            return 'timeout'
+        return self.returncode
+
+    def __str__(self):
+        return "%s: status %s in %.2fs" % (syscall.display(self.command),
+                                           self.status, self.duration)
 
 
 class syscall():
-    def __init__(self, logger):
+    """ Every command we run goes through here. Commands are argument lists,
+        run without a shell, or strings, which go through the shell.
+        run() blocks and returns a callresult, submit() runs a command on a
+        bounded pool of threads and gather() waits for them. """
+
+    def __init__(self, logger, workers=None, tracer=None):
         self.no_execute = True
         self.logger = logger
-
-    def run(self, command, doitanyway=None):
-        self.logger.info(command)
-        if (self.no_execute is None or
-                doitanyway is not None):
-            os.system(command)
+        self.tracer = tracer
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 2)
+        self.pool = None
+        self.pool_lock = threading.Lock()
+
+    @staticmethod
+    def display(command):
+        """A command as something to read."""
+        if isinstance(command, str):
+            return command
+        return ' '.join(shlex.quote(str(arg)) for arg in command)
+
+    @staticmethod
+    def program(command):
+        """The name of the program a command runs, rsync, git, ctags..."""
+        if isinstance(command, str):
+            command = command.split() or ['']
+        return os.path.basename(str(command[0]))
+
+    def executing(self, doitanyway=None):
+        return self.no_execute is None or doitanyway is not None
+
+    def run(self, command, doitanyway=None, timeout=None, capture=False, cwd=None):
+        """Run the command, return a callresult. With capture the output is
+        in the result, otherwise it goes where ours does. Nothing runs, and
+        the result is a success, when we are not executing."""
+        self.logger.info(self.display(command))
+        if not self.executing(doitanyway):
+            return callresult(command)
+
+        if self.tracer is None:
+            return self.call(command, timeout, capture, cwd)
+        with self.tracer.span(self.program(command), 'syscall.run',
+                              command=self.display(command)) as span:
+            result = self.call(command, timeout, capture, cwd)
+            span['status'] = result.status
+        return result
+
+    def call(self, command, timeout=None, capture=False, cwd=None):
+        """Really run it."""
+        import subprocess
+        pipe = subprocess.PIPE if capture else None
+        start = time.time()
+        try:
+            process = subprocess.run(command, shell=isinstance(command, str),
+                                     cwd=cwd, timeout=timeout,
+                                     stdout=pipe, stderr=pipe,
+                                     universal_newlines=True)
+            result = callresult(command, process.returncode, time.time() - start,
+                                process.stdout, process.stderr)
+        except subprocess.TimeoutExpired as e:
+            self.logger.error("Timed out after %ss: %s" % (timeout, self.display(command)))
+            output, errors = e.stdout, e.stderr
+            if isinstance(output, bytes):
+                output = output.decode('utf-8', 'replace')
+            if isinstance(errors, bytes):
+                errors = errors.decode('utf-8', 'replace')
+            result = callresult(command, None, time.time() - start, output, errors,
+                                timed_out=True)
+        except OSError as e:
+            # no such program, most likely.
+            self.logger.error("%s: %s" % (self.display(command), e))
+            result = callresult(command, 127, time.time() - start, errors=str(e))
+
+        self.logger.debug(result)
+        return result
+
+    def capture(self, command, doitanyway=None, timeout=None, cwd=None):
+        """Run the command and keep its output."""
+        return self.run(command, doitanyway, timeout, True, cwd)
+
+    def lines(self, command, doitanyway=None, cwd=None):
+        """Run the command and give its output a line at a time, as it
+        comes, so big outputs are never held in memory. Iterate over what
+        this returns, then its result says how the command went."""
+        self.logger.info(self.display(command))
+        return linestream(self, command, self.executing(doitanyway), cwd)
+
+    def stream(self, command, cwd=None, result=None):
+        """Yield the command's output lines. result, a callresult, gets the
+        exit status and time when it's done."""
+        import subprocess
+        start = time.time()
+        process = subprocess.Popen(command, shell=isinstance(command, str),
+                                   cwd=cwd,
+                                   stdout=subprocess.PIPE,
+                                   universal_newlines=True)
+        try:
+            for line in process.stdout:
+                yield line
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+            if result is not None:
+                result.returncode = returncode
+                result.duration = time.time() - start
+
+    def submit(self, command, **kwargs):
+        """Run the command on the pool. Returns a future for its callresult.
+        Takes the same keyword arguments as run."""
+        with self.pool_lock:
+            if self.pool is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        return self.pool.submit(self.run, command, **kwargs)
+
+    def gather(self, futures):
+        """Wait for submitted commands, return their callresults in order."""
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        """Wait for anything still running and put the pool away."""
+        with self.pool_lock:
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
+
+
+class linestream():
+    """ A command's output, a line at a time, from syscall.lines. Once it
+        has been read, result is the callresult. """
+
+    def __init__(self, syscall, command, executing=True, cwd=None):
+        self.syscall = syscall
+        self.command = command
+        self.executing = executing
+        self.cwd = cwd
+        self.result = callresult(command)
+
+    def __iter__(self):
+        if not self.executing:
+            return
+        tracer = self.syscall.tracer
+        try:
+            if tracer is None:
+                yield from self.syscall.stream(self.command, self.cwd, self.result)
+            else:
+                with tracer.span(self.syscall.program(self.command), 'syscall.lines',
+                                 command=self.syscall.display(self.command)):
+                    yield from self.syscall.stream(self.command, self.cwd, self.result)
+        except OSError as e:
+            self.syscall.logger.error("%s: %s" % (self.syscall.display(self.command), e))
+            self.result.returncode = 127
+            self.result.errors = str(e)
+        self.syscall.logger.debug(self.result)
 
 
 class apperror(RuntimeError):
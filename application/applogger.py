@@ -2,7 +2,10 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """
-   This is a class to manage logging
+   This is a class to manage logging. The log file is written by a
+   background thread. Records go onto a bounded queue and the thread writes
+   them to a rotating file, so a slow disk never holds up the work. If the
+   queue fills, records are dropped and counted rather than waited for.
 """
 
 __author__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
@@ -10,7 +13,32 @@ __support__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
 __version__ = '$Revision: 1 $'[11:-2]
 __application__ = 'applicationlogger'    # we don't have a name yet...
 
+import queue
 import logging
+import logging.handlers
+
+
+class boundedqueuehandler(logging.handlers.QueueHandler):
+    """ A QueueHandler that drops records, and counts them, when its queue
+        is full instead of blocking or complaining. """
+
+    def __init__(self, record_queue):
+        super().__init__(record_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class logwriter(logging.handlers.QueueListener):
+    """ The thread that writes queued records. Stopping waits for room on
+        a full queue, so nothing already queued is lost. """
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
 
 
 class applicationlogger():
@@ -18,6 +46,9 @@ class applicationlogger():
         self.logger = logging.getLogger(__application__)
 
         self.logger.setLevel(logging.WARNING)
+        self.stdio_hdlr = None
+        self.queue_hdlr = None
+        self.listener = None
         self.logger_levels = {'warning':    logging.WARNING,
                               'info':       logging.INFO,
                               'error':      logging.ERROR,
@@ -63,13 +94,41 @@ class applicationlogger():
         self.logger.addHandler(self.stdio_hdlr)
 
     def quiet(self):
-        logger.removeHandler(self.stdio_hdlr)
+        self.logger.removeHandler(self.stdio_hdlr)
 
-    def logfile(self, logfile, formatter):
+    def logfile(self, logfile, formatter, max_bytes=10 * 1024 * 1024, backups=3,
+                queue_size=10000, background=True):
+        """Log to a file that rotates at max_bytes, keeping backups old ones.
+        In the background unless asked not to."""
         # hdlr = logging.FileHandler('/var/tmp/%s.log' % __application__)
-        hdlr = logging.FileHandler(logfile, encoding='utf-8')
+        hdlr = logging.handlers.RotatingFileHandler(logfile, maxBytes=max_bytes,
+                                                    backupCount=backups,
+                                                    encoding='utf-8', delay=True)
         hdlr.setFormatter(formatter)
-        logger.addHandler(hdlr)
+        if not background:
+            self.logger.addHandler(hdlr)
+            return
+
+        self.flush()
+        self.queue_hdlr = boundedqueuehandler(queue.Queue(queue_size))
+        self.listener = logwriter(self.queue_hdlr.queue, hdlr, respect_handler_level=True)
+        self.logger.addHandler(self.queue_hdlr)
+        self.listener.start()
+
+    def flush(self):
+        """Write out everything queued for the log file and stop the
+        writer. Call it on the way out."""
+        if self.listener is None:
+            return
+        self.logger.removeHandler(self.queue_hdlr)
+        self.listener.stop()
+        for hdlr in self.listener.handlers:
+            hdlr.close()
+        if self.queue_hdlr.dropped:
+            self.logger.warning("The log file queue was full, %d records were dropped" %
+                                self.queue_hdlr.dropped)
+        self.listener = None
+        self.queue_hdlr = None
 
     def formatter(self, format):
         return logging.Formatter(format)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+   The thin end of an application's daemon. If the daemon is running, the
+   command line, working directory and environment are handed to it and
+   what the command says comes back as it says it, stdout to stdout and
+   stderr to stderr, followed by its exit status. If it isn't running,
+   forward() says so and the application runs the command itself.
+
+   Everything on the socket is a frame, a one byte channel, a four byte
+   length and the data. The request is an 'r' frame holding a marshalled
+   dictionary. The answer is '1' stdout and '2' stderr frames, then an
+   'x' frame with the exit status.
+"""
+
+__author__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__support__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__version__ = '$Revision: 1 $'[11:-2]
+
+# This runs on every command, before anything else is imported, so it
+# sticks to builtin modules, and stat, which os has already loaded.
+# _socket is the socket module without the enums and helpers, and marshal
+# is plenty for a dictionary of strings between two of our own processes.
+import os
+import sys
+import stat
+import struct
+import marshal
+
+
+# what a command needs of the caller's environment, everything else,
+# tokens and the like, stays with the caller.
+forwarded_env = ['HOME', 'PATH', 'USER', 'LOGNAME', 'SHELL', 'TERM', 'TZ',
+                 'LANG', 'TMPDIR', 'DISPLAY', 'EDITOR', 'VISUAL',
+                 'SSH_AUTH_SOCK']
+forwarded_prefixes = ('LC_', 'XDG_')
+
+
+def private(status, is_dir=False):
+    """True if an lstat is ours, and a directory only we can get into."""
+    if status.st_uid != os.getuid():
+        return False
+    if is_dir:
+        return stat.S_ISDIR(status.st_mode) and not status.st_mode & 0o077
+    return True
+
+
+def socket_path(application, create=False):
+    """Where the application's daemon listens. Local, private to us, and
+    never in a home directory that might be on a network filesystem.
+    Without $XDG_RUNTIME_DIR it's in a directory of our own in /tmp, made
+    with create. None if that directory isn't ours alone."""
+    directory = os.environ.get('XDG_RUNTIME_DIR')
+    if not directory:
+        directory = os.path.join(os.environ.get('TMPDIR') or '/tmp',
+                                 '%s-%d' % (application, os.getuid()))
+        if create:
+            try:
+                os.mkdir(directory, 0o700)
+            except FileExistsError:
+                pass
+        try:
+            if not private(os.lstat(directory), True):
+                return None
+        except OSError:
+            return None
+    return os.path.join(directory, '%s.daemon.%d' % (application, os.getuid()))
+
+
+def frame(channel, data):
+    return channel + struct.pack('!I', len(data)) + data
+
+
+def read_exactly(connection, count):
+    data = b''
+    while len(data) < count:
+        chunk = connection.recv(count - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def read_frame(connection):
+    """The next (channel, data) from the daemon, None when it hangs up."""
+    header = read_exactly(connection, 5)
+    if header is None:
+        return None
+    length = struct.unpack('!I', header[1:])[0]
+    data = read_exactly(connection, length) if length else b''
+    if data is None:
+        return None
+    return header[:1], data
+
+
+def peer_is_us(connection):
+    """True if whoever is on the other end runs as us."""
+    import _socket
+    if not hasattr(_socket, 'SO_PEERCRED'):
+        return True
+    credentials = connection.getsockopt(_socket.SOL_SOCKET, _socket.SO_PEERCRED,
+                                        struct.calcsize('3i'))
+    pid, uid, gid = struct.unpack('3i', credentials)
+    return uid == os.getuid()
+
+
+def connect(application):
+    """A connection to the daemon, or None if there isn't one. A socket
+    somebody else made, or a daemon running as somebody else, isn't
+    ours and never hears from us."""
+    path = socket_path(application)
+    try:
+        status = os.lstat(path) if path is not None else None
+    except OSError:
+        return None
+    if status is None or not stat.S_ISSOCK(status.st_mode) or not private(status):
+        return None
+    import _socket
+    connection = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+    try:
+        connection.connect(path)
+        if peer_is_us(connection):
+            return connection
+    except OSError:
+        # left over from a daemon that died.
+        pass
+    connection.close()
+    return None
+
+
+def request(application, message):
+    """Send the daemon a request and copy its answer to our stdout and
+    stderr. Returns the exit status, or None if there's no daemon."""
+    connection = connect(application)
+    if connection is None:
+        return None
+    try:
+        connection.sendall(frame(b'r', marshal.dumps(message)))
+        while True:
+            answer = read_frame(connection)
+            if answer is None:
+                sys.stderr.write("%s daemon hung up without an exit status\n" %
+                                 application)
+                return 1
+            channel, data = answer
+            if channel == b'x':
+                return int(data or 0)
+            stream = sys.stderr if channel == b'2' else sys.stdout
+            stream.flush()
+            stream.buffer.write(data)
+            stream.buffer.flush()
+    finally:
+        connection.close()
+
+
+def environment(application):
+    """The part of our environment a command run for us needs."""
+    prefixes = forwarded_prefixes + ('%s_' % application.upper(),)
+    return dict((name, value) for name, value in os.environ.items()
+                if name in forwarded_env or name.startswith(prefixes))
+
+
+def forward(application, argv, local=()):
+    """Run the command line in the daemon. None if there's no daemon, the
+    command is one of the local ones, or <APPLICATION>_NO_DAEMON is set,
+    and the caller should run it itself."""
+    if os.environ.get('%s_NO_DAEMON' % application.upper()):
+        return None
+    if any(arg in local for arg in argv):
+        return None
+    return request(application, {'command': 'run',
+                                 'argv': list(argv),
+                                 'cwd': os.getcwd(),
+                                 'env': environment(application)})
+
+
+if __name__ == "__main__":
+    pass
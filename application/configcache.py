@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+   A compiled cache of config files. A config file is parsed and
+   interpolated once, and the sections are marshalled into a private
+   directory, ~/.cache/PM, keyed by the file's path, mtime and size. After
+   that one stat of the config file says whether the cache is good, and a
+   good cache is a single read with no parsing. The cache is only read if
+   it is ours and nobody else can write it, and marshal can only ever hand
+   back data, never run anything. The sections come back as dictionaries,
+   so looking one up is a dictionary lookup.
+"""
+
+__author__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__support__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__version__ = '$Revision: 1 $'[11:-2]
+__application__ = 'configcache'
+
+import os
+import zlib
+import stat
+import marshal
+import logging
+import configparser
+
+# bump this when the layout of the cache changes.
+__cache_version__ = 2
+
+# what we've already loaded in this process, path: (key, config). A long
+# running process, the daemon, never even reads the cache twice.
+loaded = {}
+
+
+class compiledsection(dict):
+    """ A section's interpolated settings. Keys are case insensitive, like
+        a configparser section's. """
+
+    def __getitem__(self, key):
+        return dict.__getitem__(self, key.lower())
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key.lower())
+
+    def get(self, key, default=None):
+        return dict.get(self, key.lower(), default)
+
+
+class compiledconfig():
+    """ The parts of a ConfigParser we read from, backed by dictionaries. """
+
+    def __init__(self, sections, defaults=None):
+        self.section_map = dict((name, compiledsection(settings))
+                                for name, settings in sections.items())
+        self.defaults_map = compiledsection(defaults or {})
+
+    def sections(self):
+        return list(self.section_map)
+
+    def has_section(self, section):
+        return section in self.section_map
+
+    def defaults(self):
+        return self.defaults_map
+
+    def items(self, section):
+        try:
+            return list(self.section_map[section].items())
+        except KeyError:
+            raise configparser.NoSectionError(section)
+
+    def get(self, section, option, fallback=None):
+        try:
+            return self.section_map[section][option]
+        except KeyError:
+            return fallback
+
+    def __getitem__(self, section):
+        if section == configparser.DEFAULTSECT:
+            return self.defaults_map
+        return self.section_map[section]
+
+    def __contains__(self, section):
+        return section in self.section_map
+
+
+def compile_config(config):
+    """Interpolate everything in a ConfigParser now, and keep the answers."""
+    sections = {}
+    for section in config.sections():
+        sections[section] = dict(config.items(section))
+    return compiledconfig(sections, dict(config.defaults()))
+
+
+class configcache():
+    """ Load config files through the cache. """
+
+    def __init__(self, logger=None, cache_dir=None):
+        if cache_dir is None:
+            # in our own home, where nobody else can get there first.
+            cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME') or
+                                     os.path.join(os.getenv('HOME') or '/', '.cache'),
+                                     'PM')
+        self.cache_dir = cache_dir
+
+        if logger is None:
+            self.logger = logging.getLogger(__application__)
+        else:
+            self.logger = logger
+
+    def cache_file(self, config_file):
+        # the whole path is in the cache's key, a clash is just a miss.
+        path = os.path.abspath(config_file)
+        return os.path.join(self.cache_dir, '%08x.%s.config' %
+                            (zlib.crc32(path.encode('utf-8')), os.path.basename(path)))
+
+    @staticmethod
+    def private(status):
+        """Ours, and nobody else can write it."""
+        return status.st_uid == os.getuid() and not status.st_mode & 0o022
+
+    def usable_dir(self):
+        """Our directory, only if it is ours and nobody else can write it."""
+        try:
+            os.makedirs(self.cache_dir, 0o700, exist_ok=True)
+            status = os.lstat(self.cache_dir)
+        except OSError:
+            return False
+        return stat.S_ISDIR(status.st_mode) and self.private(status)
+
+    def read(self, cache_file, key):
+        """The sections and defaults in a cache file, if it is for key and
+        we can trust it. None otherwise."""
+        if not self.usable_dir():
+            return None
+        try:
+            # O_NOFOLLOW, a link someone left can't point us elsewhere.
+            fd = os.open(cache_file, os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0))
+        except OSError:
+            return None
+        with os.fdopen(fd, 'rb') as cache:
+            try:
+                if not self.private(os.fstat(fd)):
+                    self.logger.debug("Not reading %s, it isn't private" % cache_file)
+                    return None
+                cached_key, sections, defaults = marshal.load(cache)
+            except (OSError, EOFError, ValueError, TypeError):
+                return None
+        if tuple(cached_key) != key:
+            return None
+        return sections, defaults
+
+    def load(self, config_file):
+        """The config file, compiled. None if it isn't there."""
+        try:
+            stat = os.stat(config_file)
+        except OSError:
+            return None
+        key = (__cache_version__, os.path.abspath(config_file),
+               stat.st_mtime_ns, stat.st_size)
+        if key[1] in loaded and loaded[key[1]][0] == key:
+            return loaded[key[1]][1]
+
+        cache_file = self.cache_file(config_file)
+        cached = self.read(cache_file, key)
+        if cached is not None:
+            loaded[key[1]] = (key, compiledconfig(*cached))
+            return loaded[key[1]][1]
+
+        config = configparser.SafeConfigParser()
+        config.read([config_file])
+        try:
+            compiled = compile_config(config)
+        except configparser.Error as e:
+            # something won't interpolate, leave it to fail where it's used.
+            self.logger.debug("Not caching %s: %s" % (config_file, e))
+            return config
+
+        self.save(cache_file, key, compiled)
+        loaded[key[1]] = (key, compiled)
+        return compiled
+
+    def save(self, cache_file, key, compiled):
+        if not self.usable_dir():
+            return
+        sections = dict((name, dict(settings))
+                        for name, settings in compiled.section_map.items())
+        temp_file = "%s.%d" % (cache_file, os.getpid())
+        try:
+            fd = os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'wb') as cache:
+                marshal.dump((key, sections, dict(compiled.defaults_map)), cache)
+            os.replace(temp_file, cache_file)
+        except (IOError, OSError) as e:
+            self.logger.debug("Could not write config cache %s: %s" % (cache_file, e))
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+   A resident server for an applicationCore application. It is started
+   once, imports everything, loads the config and keeps whatever else the
+   application warms up, then waits on a Unix domain socket. Each request
+   is run in a fork of the warm server, in the client's directory and
+   environment, with its stdout and stderr streamed back to the client.
+   A fork per request means one command can't trip over another's
+   working directory or logging, and nothing is paid twice.
+"""
+
+__author__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__support__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__version__ = '$Revision: 1 $'[11:-2]
+__application__ = 'appdaemon'
+
+import os
+import sys
+import time
+import marshal
+import socket
+import struct
+import signal
+import logging
+import threading
+import traceback
+import socketserver
+from application.client import socket_path, frame, read_frame
+
+
+class requesthandler(socketserver.BaseRequestHandler):
+    """ One request, in its own fork of the server. """
+
+    def setup(self):
+        self.send_lock = threading.Lock()
+
+    def send(self, channel, data):
+        with self.send_lock:
+            self.request.sendall(frame(channel, data))
+
+    def peer_is_us(self):
+        """Only our own user gets to run commands as us."""
+        if not hasattr(socket, 'SO_PEERCRED'):
+            return True
+        credentials = self.request.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                              struct.calcsize('3i'))
+        pid, uid, gid = struct.unpack('3i', credentials)
+        return uid == os.getuid()
+
+    def handle(self):
+        if not self.peer_is_us():
+            return
+        request = read_frame(self.request)
+        if request is None or request[0] != b'r':
+            return
+        message = marshal.loads(request[1])
+
+        command = message.get('command')
+        if command == 'status':
+            self.send(b'1', ("%s daemon, pid %d, up %ds, listening on %s\n" %
+                             (self.server.application, os.getppid(),
+                              time.time() - self.server.started,
+                              self.server.path)).encode('utf-8'))
+            status = 0
+        elif command == 'stop':
+            os.kill(os.getppid(), signal.SIGTERM)
+            status = 0
+        elif command == 'run':
+            status = self.run(message)
+        else:
+            self.send(b'2', ("Unknown request %s\n" % command).encode('utf-8'))
+            status = 1
+        self.send(b'x', str(status).encode('utf-8'))
+
+    def pump(self, fd, channel):
+        """Send what's written to our end of a pipe to the client."""
+        while True:
+            data = os.read(fd, 65536)
+            if not data:
+                break
+            try:
+                self.send(channel, data)
+            except OSError:
+                # the client has gone, keep reading so nobody blocks.
+                pass
+        os.close(fd)
+
+    def run(self, message):
+        """Run a command line, as the client would have, with our stdout
+        and stderr, and so everything we start, going to the client."""
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pumps = []
+        for fd, channel in ((1, b'1'), (2, b'2')):
+            read_end, write_end = os.pipe()
+            os.dup2(write_end, fd)
+            os.close(write_end)
+            pump = threading.Thread(target=self.pump, args=(read_end, channel))
+            pump.daemon = True
+            pump.start()
+            pumps.append(pump)
+        null = os.open(os.devnull, os.O_RDWR)
+        os.dup2(null, 0)
+
+        os.environ.clear()
+        os.environ.update(message.get('env') or {})
+        try:
+            os.chdir(message.get('cwd') or '/')
+            status = self.server.execute(message.get('argv') or [])
+        except Exception:
+            traceback.print_exc()
+            status = 1
+
+        # hang up our ends of the pipes and let the pumps finish.
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(null, 1)
+        os.dup2(null, 2)
+        for pump in pumps:
+            pump.join(5)
+        return status
+
+
+class appdaemon(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    """ Serve an application. factory makes a fresh instance of it for each
+        request. """
+
+    def __init__(self, application, factory, logger=None, path=None):
+        self.application = application
+        self.factory = factory
+        self.path = path or socket_path(application, create=True)
+        if self.path is None:
+            raise OSError("No private directory for the %s daemon's socket" %
+                          application)
+        self.started = time.time()
+
+        if logger is None:
+            self.logger = logging.getLogger(__application__)
+        else:
+            self.logger = logger
+
+        if os.path.exists(self.path):
+            # a socket nobody is listening on is left over, take it.
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+                raise OSError("A daemon is already listening on %s" % self.path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.remove(self.path)
+            finally:
+                probe.close()
+
+        umask = os.umask(0o077)
+        try:
+            super().__init__(self.path, requesthandler)
+        finally:
+            os.umask(umask)
+
+    def execute(self, argv):
+        """Run a command line in a fresh instance of the application.
+        Returns its exit status."""
+        # the handlers belong to the server, the instance sets up its own.
+        for name in (self.logger.name, __application__):
+            log = logging.getLogger(name)
+            for handler in list(log.handlers):
+                log.removeHandler(handler)
+
+        sys.argv = [self.application] + list(argv)
+        instance = None
+        try:
+            instance = self.factory()
+            status = instance.app_main()
+        except SystemExit as e:
+            status = e.code
+        except Exception:
+            traceback.print_exc()
+            status = 1
+        finally:
+            # the fork leaves with os._exit, nothing atexit will happen.
+            if instance is not None and hasattr(instance, 'cleanup'):
+                try:
+                    instance.cleanup()
+                except Exception:
+                    traceback.print_exc()
+        if status is None:
+            return 0
+        if isinstance(status, int):
+            return status
+        sys.stderr.write('%s\n' % status)
+        return 1
+
+    def serve(self):
+        """Serve until we're told to stop."""
+        def stop(signum, frame):
+            sys.exit(0)
+        signal.signal(signal.SIGTERM, stop)
+
+        self.logger.info("%s daemon serving on %s" % (self.application, self.path))
+        try:
+            self.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server_close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.logger.info("%s daemon stopped" % self.application)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+   Time the phases of an application, and every command it runs, as spans.
+   Each span has its wall time and the cpu time of the child processes that
+   finished inside it. The spans are written as Chrome trace event JSON, so
+   chrome://tracing or Perfetto will draw them on a time line, one row per
+   thread.
+"""
+
+__author__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__support__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__version__ = '$Revision: 1 $'[11:-2]
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+
+class tracer():
+    """ Collects spans. Recording is cheap, so it is always on, and only
+        written out when someone asks for it. """
+
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.pid = os.getpid()
+
+    def microseconds(self, when):
+        return int((when - self.start) * 1000000)
+
+    @contextmanager
+    def span(self, name, category='phase', **args):
+        """Time the body of a with statement. args go in the trace, and
+        the body can add to them."""
+        begin = time.perf_counter()
+        before = os.times()
+        try:
+            yield args
+        finally:
+            end = time.perf_counter()
+            after = os.times()
+            args['child_user'] = round(after.children_user - before.children_user, 6)
+            args['child_system'] = round(after.children_system - before.children_system, 6)
+            event = {'name': name,
+                     'cat': category,
+                     'ph': 'X',
+                     'ts': self.microseconds(begin),
+                     'dur': self.microseconds(end) - self.microseconds(begin),
+                     'pid': self.pid,
+                     'tid': threading.get_ident(),
+                     'args': args}
+            with self.lock:
+                self.events.append(event)
+
+    def save(self, filename):
+        """Write the spans as a Chrome trace."""
+        import json
+        with self.lock:
+            events = sorted(self.events, key=lambda event: event['ts'])
+        with open(filename, 'w') as trace:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace)
+        return len(events)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+   Start up time budget for PM. PM runs from editor hooks and shell prompts,
+   so PM --help and a command that does nothing have to stay quick. This
+   runs each of them a number of times against a throw away home directory
+   and project, and fails if the median goes over the budget, or if --help
+   imports any of the modules that should only load for real work.
+
+       python3 benchmarks/startup.py [--runs N] [--budget MS]
+"""
+
+__author__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__support__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__version__ = '$Revision: 1 $'[11:-2]
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+PM = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'PM.py')
+
+# None of these should be imported just to print help.
+lazy_modules = ['rsync', 'subprocess', 'concurrent.futures', 'json', 'tempfile',
+                'cProfile', 'pstats']
+
+commands = [['--help'],
+            ['-noex', 'open', 'bench']]
+
+
+def make_home(home):
+    """A config file and one project, enough for PM to find its way."""
+    os.makedirs(os.path.join(home, 'Projects', 'bench'))
+    with open(os.path.join(home, '.PMrc'), 'w') as rc:
+        rc.write("[default]\n"
+                 "ProjectRoot = Projects\n"
+                 "ProjectBase = %s\n"
+                 "GitBase = %s\n"
+                 "LocalGit = GIT\n"
+                 "[bench]\n"
+                 "type = Project\n"
+                 "repository = local\n"
+                 "devHost = localhost\n"
+                 "devPath = %s\n"
+                 "directories =\n" % (home, home, os.path.join(home, 'deployed')))
+    with open(os.path.join(home, 'Projects', 'bench', '.PMrc.project'), 'w') as rc:
+        rc.write("[default]\nname = bench\n")
+
+
+def time_command(args, env, cwd, runs):
+    """The median wall time of running PM with args, in milliseconds."""
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, PM] + args, env=env, cwd=cwd,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def time_python(runs):
+    """How long an empty python takes to start, for comparison."""
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'])
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def eager_imports(env, cwd):
+    """The lazy modules that PM --help imported anyway."""
+    process = subprocess.run([sys.executable, '-X', 'importtime', PM, '--help'],
+                             env=env, cwd=cwd, stdout=subprocess.DEVNULL,
+                             stderr=subprocess.PIPE, universal_newlines=True)
+    imported = set()
+    for line in process.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            imported.add(line.rsplit('|', 1)[1].strip())
+    return [module for module in lazy_modules if module in imported]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=9, help='Runs of each command.')
+    parser.add_argument('--budget', type=float, default=100.0,
+                        help='Milliseconds each command may take, median.')
+    args = parser.parse_args()
+
+    home = tempfile.mkdtemp(prefix='PMbench.')
+    try:
+        make_home(home)
+        env = dict(os.environ, HOME=home)
+        cwd = os.path.join(home, 'Projects', 'bench')
+        failed = False
+
+        # once to fill the config cache, like every run after the first.
+        subprocess.run([sys.executable, PM, '--help'], env=env, cwd=cwd,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        baseline = time_python(args.runs)
+        print("%-24s %8.1f ms" % ('python itself', baseline))
+        for command in commands:
+            median = time_command(command, env, cwd, args.runs)
+            over = median > args.budget
+            failed = failed or over
+            print("%-24s %8.1f ms%s" % ('PM ' + ' '.join(command), median,
+                                        '  over the %.0f ms budget' % args.budget
+                                        if over else ''))
+
+        eager = eager_imports(env, cwd)
+        if eager:
+            failed = True
+            print("PM --help imported %s" % ', '.join(eager))
+        return 1 if failed else 0
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
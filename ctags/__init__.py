@@ -0,0 +1,6 @@
+# outer __init__.py
+from ctags.tagger import tagger
+from ctags.tagfile import merge_tags
+from ctags.tagfile import find_tags
+
+__all__ = [tagger, merge_tags, find_tags]
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+   Sorted ctags files. A tags file is a few !_TAG_ header lines followed by
+   one line per tag, name, file and address separated by tabs, sorted by
+   byte value so editors can binary search it. Tags files are merged here a
+   line at a time, never read in whole, so a tags file of any size costs no
+   more memory than the lines in flight. Looking a tag up maps the file and
+   binary searches it in place, reading a few dozen lines at most.
+"""
+
+__author__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__support__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__version__ = '$Revision: 1 $'[11:-2]
+
+import os
+import mmap
+import heapq
+import itertools
+
+header_prefix = b'!_'
+
+
+def tag_file(line):
+    """The file a tag line points into, as bytes."""
+    fields = line.split(b'\t', 2)
+    return fields[1] if len(fields) > 1 else b''
+
+
+def split_header(lines):
+    """The header lines at the top of a tags file, and an iterator over
+    the rest of it."""
+    header = []
+    lines = iter(lines)
+    for line in lines:
+        if line.startswith(header_prefix):
+            header.append(line)
+            continue
+        return header, itertools.chain([line], lines)
+    return header, iter(())
+
+
+def merge_tags(tags_file, sources, drop=()):
+    """Merge sorted tags files into tags_file, which may be one of them.
+    If it is, its tags for the files in drop, as bytes paths, are left
+    out, they are the ones being replaced. The header lines of all of
+    them come first, once each. Returns the number of tags written."""
+    opened = []
+    header = []
+    bodies = []
+    drop = set(drop)
+    try:
+        for source in sources:
+            if not os.path.exists(source):
+                continue
+            f = open(source, 'rb')
+            opened.append(f)
+            lines, body = split_header(f)
+            header.extend(line for line in lines if line not in header)
+            if drop and source == tags_file:
+                body = (line for line in body if tag_file(line) not in drop)
+            bodies.append(body)
+
+        temp_file = '%s.%d' % (tags_file, os.getpid())
+        count = 0
+        with open(temp_file, 'wb') as merged:
+            merged.writelines(sorted(header))
+            for line in heapq.merge(*bodies):
+                if not line.endswith(b'\n'):
+                    line += b'\n'
+                merged.write(line)
+                count += 1
+        os.replace(temp_file, tags_file)
+        return count
+    finally:
+        for f in opened:
+            f.close()
+
+
+def parse_tag(line):
+    """A tag line as a dictionary, name, file, address and whatever
+    extension fields it has, kind, line, class..."""
+    fields = line.rstrip(b'\r\n').decode('utf-8', 'replace').split('\t')
+    address = fields[2] if len(fields) > 2 else ''
+    tag = {'name': fields[0],
+           'file': fields[1] if len(fields) > 1 else '',
+           'address': address[:-2] if address.endswith(';"') else address}
+    for field in fields[3:]:
+        if ':' in field:
+            key, value = field.split(':', 1)
+            tag[key] = value
+        elif field:
+            tag['kind'] = field
+    return tag
+
+
+def lower_bound(data, key):
+    """The offset of the first line in data whose name is not less than
+    key, or the end of data."""
+    lo, hi = 0, len(data)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start = data.rfind(b'\n', 0, mid) + 1
+        end = data.find(b'\n', start)
+        if end == -1:
+            end = len(data)
+        tab = data.find(b'\t', start, end)
+        if data[start:tab if tab != -1 else end] < key:
+            lo = end + 1
+        else:
+            hi = start
+    return lo
+
+
+def find_tags(tags_file, name, prefix=False):
+    """The tags named name, or starting with it, in a sorted tags file, as
+    dictionaries. The file is mapped and searched where it lies."""
+    key = name.encode('utf-8') if isinstance(name, str) else name
+    try:
+        f = open(tags_file, 'rb')
+    except (IOError, OSError):
+        return []
+    with f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # an empty file can't be mapped, and has nothing in it anyway.
+            return []
+        with data:
+            tags = []
+            position = lower_bound(data, key)
+            while position < len(data):
+                end = data.find(b'\n', position)
+                if end == -1:
+                    end = len(data)
+                tab = data.find(b'\t', position, end)
+                found = data[position:tab if tab != -1 else end]
+                if found != key and not (prefix and found.startswith(key)):
+                    break
+                tags.append(parse_tag(data[position:end]))
+                position = end + 1
+            return tags
+
+
+if __name__ == "__main__":
+    pass
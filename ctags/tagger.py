@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+   Keep a project's tags file up to date without tagging everything every
+   time. The size and mtime of every file tagged is kept in the project's
+   manifest, like a deploy to a host of its own, so the next run knows
+   which files were added, changed or deleted. Only those are tagged
+   again, and the new tags are merged into the sorted tags file in place
+   of the old ones.
+
+   A lot of files are split into shards of about the same size, one per
+   cpu, and each shard gets a ctags of its own, all at once. Their sorted
+   outputs are merged into the one tags file.
+"""
+
+__author__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__support__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__version__ = '$Revision: 1 $'[11:-2]
+__application__ = '__ctags__'
+
+import os
+import heapq
+import shlex
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from rsync.manifest import manifest
+from rsync.excludes import exclude_filter
+from ctags.tagfile import merge_tags
+
+default_ctags = '/usr/local/bin/ctags'
+
+# fewer files than this aren't worth a ctags of their own.
+min_shard_files = 100
+
+# the manifest's entry for the tags file, not a host anyone can deploy to.
+__manifest_host__ = ':ctags'
+
+
+class tagger():
+    """ Tags for one project. ctags_cmd is the ctags program, with any
+        options it should always get, jobs how many ctags to run at once,
+        one per cpu by default. """
+
+    def __init__(self, cmd, logger=None, path=None, excludes=None,
+                 ctags_cmd=None, tags_file='tags', jobs=None):
+        self.cmd = cmd
+        self.path = path
+        self.tags_file = tags_file
+        self.ctags_cmd = shlex.split(ctags_cmd or default_ctags)
+        self.jobs = max(1, int(jobs or os.cpu_count() or 1))
+
+        if logger is None:
+            self.logger = logging.getLogger(__application__)
+        else:
+            self.logger = logger
+
+        # never tag the tags.
+        self.tree = manifest(path, __manifest_host__,
+                             exclude_filter(excludes, ['/%s' % tags_file]),
+                             self.logger)
+
+    def ctags(self, files, output):
+        """Run ctags on files, relative paths, writing output."""
+        fd, list_file = tempfile.mkstemp(prefix='PMctags.', suffix='.list')
+        with os.fdopen(fd, 'w') as listing:
+            for relpath in files:
+                listing.write('%s\n' % relpath)
+        try:
+            return self.cmd.run(self.ctags_cmd + ['-f', output, '-L', list_file],
+                                cwd=self.path)
+        finally:
+            os.remove(list_file)
+
+    def shards(self, files):
+        """Split files into at most jobs lists of about the same total
+        size. The biggest files are dealt out first, each to the
+        smallest shard so far."""
+        count = min(self.jobs, len(files) // min_shard_files)
+        if count <= 1:
+            return [files]
+        entries = self.tree.entries or {}
+
+        def size(relpath):
+            return entries[relpath][0] if relpath in entries else 0
+
+        shards = [(0, i, []) for i in range(count)]
+        for relpath in sorted(files, key=size, reverse=True):
+            total, i, shard = heapq.heappop(shards)
+            shard.append(relpath)
+            heapq.heappush(shards, (total + size(relpath), i, shard))
+        return [sorted(shard) for total, i, shard in sorted(shards, key=lambda s: s[1])]
+
+    def tag(self, files, output):
+        """Tag files into output, sharded if there are enough of them.
+        Returns the ctags result, the first that failed if any did."""
+        shards = self.shards(files)
+        if len(shards) == 1:
+            return self.ctags(files, output)
+
+        output = os.path.join(self.path, output)
+        outputs = ['%s.shard%d.%d' % (output, i, os.getpid()) for i in range(len(shards))]
+        self.logger.info("Tagging %d files in %d shards" % (len(files), len(shards)))
+        try:
+            with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+                results = list(pool.map(self.ctags, shards, outputs))
+            failed = [result for result in results if result.status]
+            if failed:
+                return failed[0]
+            if self.cmd.executing():
+                count = merge_tags(output, outputs)
+                self.logger.debug("Merged %d tags from %d shards" % (count, len(shards)))
+            return results[-1]
+        finally:
+            for shard_output in outputs:
+                if os.path.exists(shard_output):
+                    os.remove(shard_output)
+
+    def tag_all(self):
+        """Tag every file in the tree."""
+        self.tree.scan()
+        self.logger.info("Tagging all %d files" % len(self.tree.entries))
+        return self.tag(sorted(self.tree.entries), self.tags_file)
+
+    def tag_changes(self, changed, deleted):
+        """Tag the changed files and merge them in, dropping the tags of
+        the changed and deleted files."""
+        tags_file = os.path.join(self.path, self.tags_file)
+        partial = '%s.partial.%d' % (tags_file, os.getpid())
+        try:
+            result = None
+            if changed:
+                result = self.tag(changed, partial)
+            if not self.cmd.executing() or (result is not None and result.status):
+                return result
+            drop = [os.fsencode(relpath) for relpath in changed + deleted]
+            count = merge_tags(tags_file, [tags_file, partial], drop)
+            self.logger.info("%d tags in %s" % (count, self.tags_file))
+            return result
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+
+    def update(self, full=False):
+        """Bring the tags file up to date, tagging everything if we have to
+        or are asked to."""
+        changes = None
+        if not full and os.path.exists(os.path.join(self.path, self.tags_file)):
+            changes = self.tree.changes()
+
+        if changes is None:
+            result = self.tag_all()
+        else:
+            changed, deleted = changes
+            if not changed and not deleted:
+                self.logger.info("%s is up to date" % self.tags_file)
+                return None
+            result = self.tag_changes(changed, deleted)
+
+        # with -noex nothing was tagged, so there's nothing to remember.
+        if self.cmd.executing() and (result is None or not result.status):
+            self.tree.commit()
+        return result
+
+
+if __name__ == "__main__":
+    pass
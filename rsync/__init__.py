@@ -1,5 +1,15 @@
 # outer __init__.py
 from rsync.rsync import rsync
 from rsync.rsync import connection
+from rsync.planner import transfer_plan
+from rsync.sshmaster import sshmaster
+from rsync.manifest import manifest
+from rsync.watcher import watcher
+from rsync.stats import transfer_result
+from rsync.tuning import link_tuner
+from rsync.localcopy import local_copy
+from rsync.jobs import remote_job
+from rsync.excludes import exclude_filter
 
-__all__ = [rsync, connection]
+__all__ = [rsync, connection, transfer_plan, sshmaster, manifest, watcher,
+           transfer_result, link_tuner, local_copy, remote_job, exclude_filter]
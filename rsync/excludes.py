@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+   One set of excludes for everything. The built in excludes, the [default]
+   section's and the project's are merged and cleaned up into a filter
+   that can write an rsync --exclude-from file for a transfer, and that
+   can answer for Python side walks with one precompiled regex, so ctags,
+   manifests and scans skip exactly what rsync skips, without stat-ing
+   any of it.
+"""
+
+__author__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__support__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__version__ = '$Revision: 1 $'[11:-2]
+
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+from rsync.planner import split_list
+
+# version control, and PM's own state: manifests, results markers, the
+# log and its backups, copies in flight and partial tags files.
+builtin_excludes = ['.git', '.CVS', '.com', '.obj',
+                    '.PMmanifest', '.PMmanifest.*', '.PMresults', '.PM.log*',
+                    '.*.PMcopy', 'tags.partial.*', 'tags.shard*']
+
+
+def translate(pattern):
+    """An rsync exclude pattern as a regex for a path relative to the top
+    of the tree. A leading / anchors it to the top, a pattern with a /
+    in it matches the end of the path, anything else matches a name at
+    any depth. ** crosses directories, * and ? don't."""
+    anchored = pattern.startswith('/')
+    pattern = pattern.strip('/')
+
+    regex = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith('***', i) and i + 3 == len(pattern):
+            # dir/*** is the directory and everything in it.
+            if regex and regex[-1] == '/':
+                regex.pop()
+            regex.append('(?:/.*)?')
+            i += 3
+        elif pattern.startswith('**', i):
+            regex.append('.*')
+            i += 2
+        elif c == '*':
+            regex.append('[^/]*')
+            i += 1
+        elif c == '?':
+            regex.append('[^/]')
+            i += 1
+        elif c == '[':
+            end = pattern.find(']', i + 1)
+            if end == -1:
+                regex.append('\\[')
+                i += 1
+            else:
+                chars = pattern[i + 1:end]
+                if chars.startswith('!'):
+                    chars = '^' + chars[1:]
+                regex.append('[%s]' % chars.replace('\\', '\\\\'))
+                i = end + 1
+        elif c == '\\' and i + 1 < len(pattern):
+            regex.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            regex.append(re.escape(c))
+            i += 1
+
+    if anchored:
+        return '^%s$' % ''.join(regex)
+    return '(?:^|/)%s$' % ''.join(regex)
+
+
+class exclude_filter:
+    """ The merged excludes. Give it any number of lists or config strings.
+        patterns is the clean list, for rsync filter rules and plans. """
+
+    def __init__(self, *sources):
+        self.patterns = []
+        for source in sources:
+            if isinstance(source, exclude_filter):
+                source = source.patterns
+            for pattern in split_list(source):
+                if pattern not in self.patterns:
+                    self.patterns.append(pattern)
+        self.compile()
+
+    def compile(self):
+        """Build one regex for files and one for directories. Patterns with
+        a trailing / only ever match directories."""
+        files = []
+        directories = []
+        for pattern in self.patterns:
+            regex = translate(pattern)
+            directories.append(regex)
+            if not pattern.endswith('/'):
+                files.append(regex)
+        self.file_regex = re.compile('|'.join(files)) if files else None
+        self.directory_regex = re.compile('|'.join(directories)) if directories else None
+
+    def excluded(self, relpath, is_dir=False):
+        """True if relpath, relative to the top of the tree, is excluded."""
+        regex = self.directory_regex if is_dir else self.file_regex
+        return regex is not None and regex.search(relpath) is not None
+
+    def excluded_path(self, relpath, is_dir=False):
+        """Like excluded, but also true when any directory above relpath is
+        excluded. For paths that didn't come from a pruned walk."""
+        parts = relpath.split('/')
+        for i in range(1, len(parts)):
+            if self.excluded('/'.join(parts[:i]), True):
+                return True
+        return self.excluded(relpath, is_dir)
+
+    def prune(self, directory, names):
+        """Take the excluded directories out of an os.walk list, in place.
+        directory is relative to the top of the tree."""
+        names[:] = [name for name in names
+                    if not self.excluded(os.path.join(directory, name) if directory else name,
+                                         True)]
+
+    @contextmanager
+    def exclude_from(self):
+        """An rsync --exclude-from file for the body of a with statement.
+        It is removed when the body is done, so nothing is left to atexit,
+        which a forked daemon request never runs."""
+        fd, exclude_file = tempfile.mkstemp(prefix='PMexcludes.')
+        try:
+            with os.fdopen(fd, 'w') as exclude_from:
+                for pattern in self.patterns:
+                    exclude_from.write('%s\n' % pattern)
+            yield exclude_file
+        finally:
+            os.remove(exclude_file)
+
+    def __str__(self):
+        return ', '.join(self.patterns)
+
+
+if __name__ == "__main__":
+    pass
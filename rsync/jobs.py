@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+   Run commands on remote hosts, over their shared ssh connections, and
+   stream what they say back a line at a time as they say it. Each job
+   has an optional timeout, and any number of them can run side by side.
+   A timeout is kept on the host, by timeout(1), since killing our ssh
+   leaves the command running over there.
+"""
+
+__author__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__support__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__version__ = '$Revision: 1 $'[11:-2]
+__application__ = '__rsync__'
+
+import os
+import math
+import time
+import shlex
+import signal
+import logging
+import threading
+import subprocess
+
+# what timeout(1) exits with when it stopped the command, TERM or KILL.
+timed_out_status = (124, 137)
+
+# seconds past the timeout before we stop waiting for the host and
+# kill our end.
+grace = 30
+
+
+def with_timeout(command, timeout):
+    """A shell command line that runs command for at most timeout seconds,
+    then stops it, and anything it started, wherever it runs."""
+    return 'timeout -k 10 %d sh -c %s' % (math.ceil(timeout), shlex.quote(command))
+
+
+class remote_job:
+    """ One command line, usually an ssh to a host, run to completion or
+        until it times out. The command should be wrapped by with_timeout
+        on the host, we only kill our end if the host doesn't stop it. """
+
+    def __init__(self, name, command, logger=None, timeout=None, no_execute=None):
+        self.name = name
+        self.command = command
+        self.timeout = timeout
+        self.no_execute = no_execute
+        self.status = None
+        self.duration = 0.0
+
+        if logger is None:
+            self.logger = logging.getLogger(__application__)
+        else:
+            self.logger = logger
+
+    def stream(self, pipe, label, start):
+        """Log each line of a pipe with the job name and how far in we are."""
+        for line in pipe:
+            self.logger.info("[%s %s +%.1fs] %s" %
+                             (self.name, label, time.time() - start, line.rstrip('\n')))
+        pipe.close()
+
+    def run(self):
+        """Run the job, returns its exit status, or 'timeout'."""
+        self.logger.info("%s: %s" % (self.name, self.command))
+        if self.no_execute:
+            self.status = 0
+            return self.status
+
+        start = time.time()
+        # its own process group, so a timeout takes out everything it started.
+        process = subprocess.Popen(self.command, shell=True,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE,
+                                   universal_newlines=True,
+                                   start_new_session=True)
+        readers = [threading.Thread(target=self.stream, args=(process.stdout, 'out', start)),
+                   threading.Thread(target=self.stream, args=(process.stderr, 'err', start))]
+        for reader in readers:
+            reader.daemon = True
+            reader.start()
+
+        try:
+            self.status = process.wait(timeout=self.timeout and self.timeout + grace)
+            if self.timeout and self.status in timed_out_status:
+                self.logger.error("%s: timed out after %ss" % (self.name, self.timeout))
+                self.status = 'timeout'
+        except subprocess.TimeoutExpired:
+            self.logger.error("%s: still running %ss after its %ss timeout, giving up on it" %
+                              (self.name, grace, self.timeout))
+            self.kill(process)
+            self.status = 'timeout'
+
+        for reader in readers:
+            reader.join()
+        self.duration = time.time() - start
+        self.logger.info("%s: finished with status %s in %.1fs" %
+                         (self.name, self.status, self.duration))
+        return self.status
+
+    def kill(self, process):
+        """Terminate the job's process group, then kill it if it won't go."""
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+        except OSError:
+            pass
+
+
+if __name__ == "__main__":
+    pass
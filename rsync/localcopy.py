@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+   An in process sync engine for when the other end is this machine. rsync
+   spawns processes, computes deltas and compresses, none of which helps
+   between two local paths. This compares sizes and mtimes like rsync's
+   quick check, honours the same plan and excludes, and copies with
+   reflinks or copy_file_range, or a plain buffered copy when neither
+   works, several files at a time.
+"""
+
+__author__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__support__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__version__ = '$Revision: 1 $'[11:-2]
+__application__ = '__rsync__'
+
+import os
+import time
+import shutil
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from rsync.manifest import manifest
+from rsync.stats import transfer_result
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl to share a file's extents on btrfs, xfs and friends.
+FICLONE = 0x40049409
+
+
+def reflink(source_fd, destination_fd):
+    """Clone the source into the destination. False if we can't."""
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(destination_fd, FICLONE, source_fd)
+        return True
+    except OSError:
+        return False
+
+
+def copy_range(source_fd, destination_fd, size):
+    """Copy in the kernel with copy_file_range. False if we can't, or
+    couldn't copy all of it, the file shrank or the filesystem stopped
+    playing along, and the caller should copy it some other way."""
+    if not hasattr(os, 'copy_file_range'):
+        return False
+    copied = 0
+    try:
+        while copied < size:
+            count = os.copy_file_range(source_fd, destination_fd, size - copied)
+            if count == 0:
+                break
+            copied += count
+    except OSError:
+        return False
+    return copied >= size
+
+
+def copy_file(source, destination):
+    """Copy a file's contents, and its mode and times, as cheaply as the
+    filesystem allows. The copy is made beside the destination and moved
+    into place so nobody sees half a file."""
+    temp_file = os.path.join(os.path.dirname(destination),
+                             '.%s.PMcopy' % os.path.basename(destination))
+    stat = os.stat(source)
+    try:
+        with open(source, 'rb') as src, open(temp_file, 'wb') as dst:
+            if not (reflink(src.fileno(), dst.fileno()) or
+                    copy_range(src.fileno(), dst.fileno(), stat.st_size)):
+                # start again from the top, with a plain buffered copy.
+                src.seek(0)
+                dst.seek(0)
+                dst.truncate()
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+        shutil.copymode(source, temp_file)
+        os.utime(temp_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.replace(temp_file, destination)
+    except BaseException:
+        if os.path.lexists(temp_file):
+            os.remove(temp_file)
+        raise
+    return stat.st_size
+
+
+class local_copy:
+    """ Sync a plan, or a list of paths, from one local directory to
+        another. """
+
+    def __init__(self, source, destination, logger=None, parallelism=4,
+                 no_execute=None):
+        self.source = source
+        self.destination = destination
+        self.parallelism = max(1, parallelism)
+        self.no_execute = no_execute
+
+        if logger is None:
+            self.logger = logging.getLogger(__application__)
+        else:
+            self.logger = logger
+
+    def needs_copy(self, relpath, stat):
+        """rsync -u's quick check. Different size or time, and not newer
+        on the other end."""
+        try:
+            existing = os.lstat(os.path.join(self.destination, relpath))
+        except OSError:
+            return True
+        if existing.st_mtime_ns > stat[1]:
+            return False
+        return existing.st_size != stat[0] or existing.st_mtime_ns != stat[1]
+
+    def copy(self, relpath):
+        """Copy one file, or recreate one symlink."""
+        source = os.path.join(self.source, relpath)
+        destination = os.path.join(self.destination, relpath)
+        os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+        if os.path.islink(source):
+            if os.path.lexists(destination):
+                os.remove(destination)
+            os.symlink(os.readlink(source), destination)
+            return 0
+        return copy_file(source, destination)
+
+    def delete(self, relpath):
+        destination = os.path.join(self.destination, relpath)
+        if os.path.lexists(destination) and not os.path.isdir(destination):
+            os.remove(destination)
+
+    def run(self, entries, deleted=None, name='.'):
+        """Copy the entries, relpath: [size, mtime_ns, ...], that need it."""
+        result = transfer_result(name)
+        result.transfers = 1
+        start = time.time()
+
+        result.files_considered = len(entries)
+        result.total_size = sum(entry[0] for entry in entries.values())
+        to_copy = [relpath for relpath in sorted(entries)
+                   if self.needs_copy(relpath, entries[relpath])]
+
+        self.logger.info("local copy %s -> %s: %d of %d files" %
+                         (self.source, self.destination, len(to_copy), len(entries)))
+        if self.no_execute:
+            return result
+
+        with ThreadPoolExecutor(max_workers=self.parallelism) as pool:
+            futures = [(relpath, pool.submit(self.copy, relpath)) for relpath in to_copy]
+            for relpath, future in futures:
+                try:
+                    result.literal_bytes += future.result()
+                    result.files_transferred += 1
+                    result.changes.append(('>f', relpath))
+                except (IOError, OSError) as e:
+                    self.logger.error("Could not copy %s: %s" % (relpath, e))
+                    result.status = 23   # rsync's partial transfer.
+
+        for relpath in deleted or []:
+            self.delete(relpath)
+            result.changes.append(('*deleting', relpath))
+
+        result.transferred_size = result.literal_bytes
+        result.wall_time = time.time() - start
+        self.logger.info(result)
+        return result
+
+    def sync_plan(self, plan, name='.', delete=False):
+        """Copy everything in the plan that has changed. With delete, what
+        the plan covers on the other end but isn't here is deleted, like
+        rsync --delete."""
+        entries = manifest(self.source, None, plan.excludes, self.logger).scan(plan)
+        deleted = None
+        if delete:
+            there = manifest(self.destination, None, plan.excludes, self.logger).scan(plan)
+            deleted = sorted(relpath for relpath in there if relpath not in entries)
+        return self.run(entries, deleted, name)
+
+    def sync_paths(self, paths, deleted=None, excludes=None, name='.'):
+        """Copy these paths, relative to the source, and delete those."""
+        tree = manifest(self.source, None, excludes, self.logger)
+        entries = {}
+        for relpath in paths:
+            if tree.excluded(os.path.basename(relpath), relpath):
+                continue
+            try:
+                stat = os.lstat(os.path.join(self.source, relpath))
+            except OSError:
+                continue
+            entries[relpath] = [stat.st_size, stat.st_mtime_ns, None]
+        return self.run(entries, deleted, name)
+
+
+if __name__ == "__main__":
+    pass
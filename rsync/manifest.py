@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+   A content manifest of a project tree. It records the path, size, mtime
+   and optionally a hash of every file we deployed to each host, so the
+   next deploy can work out locally, with one fast scandir pass, what
+   changed and hand just those paths to rsync.
+"""
+
+__author__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__support__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__version__ = '$Revision: 1 $'[11:-2]
+__application__ = '__rsync__'
+
+import os
+import json
+import fnmatch
+import hashlib
+import logging
+from rsync.excludes import exclude_filter, builtin_excludes
+
+__manifest_file__ = '.PMmanifest'
+
+
+def file_hash(path):
+    """sha1 of a file's contents"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class manifest:
+    """ The manifest lives at the top of the project, next to .PMrc.project.
+        Each host we deploy to has its own set of entries,
+        path: [size, mtime_ns, hash]. The hash is only filled in when
+        hashing is on, and saves sending files that were touched but not
+        changed. """
+
+    def __init__(self, path, host, excludes=None, logger=None,
+                 filename=__manifest_file__, hashing=False):
+        self.path = path
+        self.host = host or 'localhost'
+        self.hashing = hashing
+        self.filename = filename
+        self.manifest_file = os.path.join(path, filename)
+        self.excludes = exclude_filter(builtin_excludes, excludes)
+        self.entries = None
+
+        if logger is None:
+            self.logger = logging.getLogger(__application__)
+        else:
+            self.logger = logger
+
+    def load(self):
+        """Load everything we know about every host."""
+        try:
+            with open(self.manifest_file) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def deployed(self):
+        """What we last deployed to our host, or None if we never have."""
+        return self.load().get(self.host)
+
+    def save(self, entries):
+        """Record entries as deployed to our host."""
+        hosts = self.load()
+        hosts[self.host] = entries
+        temp_file = "%s.%d" % (self.manifest_file, os.getpid())
+        with open(temp_file, 'w') as f:
+            json.dump(hosts, f, separators=(',', ':'))
+        os.replace(temp_file, self.manifest_file)
+
+    def excluded(self, name, relpath, is_dir=False):
+        """True for excluded paths, and for the manifest itself."""
+        if name == self.filename:
+            return True
+        return self.excludes.excluded_path(relpath, is_dir)
+
+    def walk(self, directory=''):
+        """Yield relative path and stat of every file below directory."""
+        stack = [directory]
+        while stack:
+            current = stack.pop()
+            try:
+                entries = os.scandir(os.path.join(self.path, current))
+            except OSError as e:
+                self.logger.debug("Could not scan %s: %s" % (current, e))
+                continue
+            with entries:
+                for entry in entries:
+                    relpath = os.path.join(current, entry.name) if current else entry.name
+                    if entry.name == self.filename:
+                        continue
+                    # d_type tells us what it is, no stat needed to skip it.
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    if self.excludes.excluded(relpath, is_dir):
+                        continue
+                    if is_dir:
+                        stack.append(relpath)
+                    else:
+                        yield relpath, entry.stat(follow_symlinks=False)
+
+    def scan(self, plan=None):
+        """Size and mtime of everything in the plan, or the whole tree."""
+        entries = {}
+        if plan is None or plan.whole_tree:
+            roots = ['']
+        else:
+            roots = [d for d in plan.directories
+                     if os.path.isdir(os.path.join(self.path, d))]
+            # patterns only ever come from the top of the tree.
+            for pattern in plan.patterns:
+                for name in fnmatch.filter(os.listdir(self.path), pattern):
+                    if (os.path.isfile(os.path.join(self.path, name)) and
+                            not self.excluded(name, name)):
+                        stat = os.lstat(os.path.join(self.path, name))
+                        entries[name] = [stat.st_size, stat.st_mtime_ns, None]
+
+        for root in roots:
+            for relpath, stat in self.walk(root):
+                entries[relpath] = [stat.st_size, stat.st_mtime_ns, None]
+        self.entries = entries
+        return entries
+
+    def changes(self, plan=None):
+        """Compare the tree to what we last deployed. Returns the lists of
+        changed and deleted paths, or None if we have never deployed
+        to this host."""
+        deployed = self.deployed()
+        current = self.scan(plan)
+        if deployed is None:
+            return None
+
+        changed = []
+        for relpath, entry in current.items():
+            old = deployed.get(relpath)
+            if old is not None and old[:2] == entry[:2]:
+                entry[2] = old[2]
+                continue
+            if self.hashing and old is not None and old[2] is not None:
+                entry[2] = file_hash(os.path.join(self.path, relpath))
+                if entry[2] == old[2]:
+                    continue
+            changed.append(relpath)
+
+        deleted = [relpath for relpath in deployed if relpath not in current]
+        self.logger.info("%d changed, %d deleted of %d files" %
+                         (len(changed), len(deleted), len(current)))
+        return changed, deleted
+
+    def stat(self, paths):
+        """Size and mtime of just these paths, those that are still here."""
+        entries = {}
+        for relpath in paths:
+            try:
+                stat = os.lstat(os.path.join(self.path, relpath))
+            except OSError:
+                continue
+            entries[relpath] = [stat.st_size, stat.st_mtime_ns, None]
+        return entries
+
+    def record(self, entries, deleted=()):
+        """Record some entries, from stat, as deployed and forget the
+        deleted paths, leaving the rest as they were. A host we have never
+        deployed to gets nothing, its first deploy still sends it all."""
+        deployed = self.deployed()
+        if deployed is None:
+            return
+        for relpath, entry in entries.items():
+            if self.hashing and entry[2] is None:
+                entry[2] = file_hash(os.path.join(self.path, relpath))
+            deployed[relpath] = entry
+        for relpath in deleted:
+            deployed.pop(relpath, None)
+        self.save(deployed)
+
+    def commit(self):
+        """Record the last scan as deployed."""
+        if self.entries is None:
+            self.scan()
+        if self.hashing:
+            for relpath, entry in self.entries.items():
+                if entry[2] is None:
+                    entry[2] = file_hash(os.path.join(self.path, relpath))
+        self.save(self.entries)
+
+
+if __name__ == "__main__":
+    pass
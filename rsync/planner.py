@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+   A transfer planner for rsync. Directories, file patterns and excludes
+   are collected into one deduplicated set of filter rules so a whole
+   project moves with a single rsync, one ssh handshake and one file list
+   walk, instead of one rsync per directory and pattern.
+"""
+
+__author__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__support__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__version__ = '$Revision: 1 $'[11:-2]
+
+import os
+import fnmatch
+import tempfile
+
+
+def split_list(value):
+    """Turn a config value into a clean list. Config values come to us as
+    comma separated strings with or without quotes, lists, or None."""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+
+    items = []
+    for item in value:
+        if item is None:
+            continue
+        # split nested comma separated strings, like a config value that
+        # was appended to a list.
+        for part in str(item).split(','):
+            part = part.strip().strip('\'"').strip()
+            if part and part not in items:
+                items.append(part)
+    return items
+
+
+class transfer_plan:
+    """ The set of things to move in one rsync. An empty directory list, or
+        a directory of '.', means the whole tree unless whole_tree says
+        otherwise. Everything below a whole tree transfer is redundant and
+        is dropped. """
+
+    def __init__(self, directories=None, patterns=None, excludes=None,
+                 whole_tree=None):
+        self.excludes = split_list(excludes)
+        self.directories = []
+        self.patterns = []
+
+        directories = split_list(directories)
+        if whole_tree is None:
+            whole_tree = not len(directories)
+        self.whole_tree = whole_tree
+
+        for directory in directories:
+            self.add_directory(directory)
+
+        for pattern in split_list(patterns):
+            self.add_pattern(pattern)
+
+    def add_directory(self, directory):
+        """Add a directory relative to the top of the transfer, dropping it,
+        or the directories it covers, as needed."""
+        directory = os.path.normpath(directory).strip('/')
+        if directory in ('', '.'):
+            self.whole_tree = True
+            self.directories = []
+            self.patterns = []
+            return
+        if self.whole_tree:
+            return
+
+        for existing in self.directories:
+            if directory == existing or directory.startswith(existing + '/'):
+                return
+
+        self.directories = [d for d in self.directories
+                            if not d.startswith(directory + '/')]
+        self.directories.append(directory)
+
+    def exclude_directory(self, directory):
+        """Leave a directory out, usually because another plan has it."""
+        directory = os.path.normpath(directory).strip('/')
+        rule = '/%s/' % directory
+        if rule not in self.excludes:
+            self.excludes.append(rule)
+
+    def add_pattern(self, pattern):
+        """Add a file pattern from the top of the transfer."""
+        if self.whole_tree or pattern in self.patterns:
+            return
+        self.patterns.append(pattern)
+
+    def selects(self, path):
+        """True if the plan would transfer path, relative to the top.
+        Excludes are left to rsync."""
+        if self.whole_tree:
+            return True
+        for directory in self.directories:
+            if path.startswith(directory + '/'):
+                return True
+        if '/' not in path:
+            for pattern in self.patterns:
+                if fnmatch.fnmatch(path, pattern):
+                    return True
+        return False
+
+    def rules(self):
+        """The rsync filter rules for this plan. Excludes come first so they
+        win, then the includes and a final exclude of everything else."""
+        rules = []
+        for exclude in self.excludes:
+            rules.append('- %s' % exclude)
+
+        if self.whole_tree:
+            return rules
+
+        # rsync has to be allowed into each parent directory on the way down.
+        parents = []
+        for directory in self.directories:
+            parts = directory.split('/')
+            for i in range(1, len(parts)):
+                parent = '/'.join(parts[:i])
+                if parent not in parents:
+                    parents.append(parent)
+
+        for parent in parents:
+            rules.append('+ /%s/' % parent)
+
+        for directory in self.directories:
+            rules.append('+ /%s/***' % directory)
+
+        for pattern in self.patterns:
+            rules.append('+ /%s' % pattern)
+
+        rules.append('- *')
+        return rules
+
+    def write(self):
+        """Write the filter rules to a temporary file and return its name.
+        The caller removes it."""
+        fd, filename = tempfile.mkstemp(prefix='PMfilter.', suffix='.rules')
+        with os.fdopen(fd, 'w') as rules_file:
+            for rule in self.rules():
+                rules_file.write('%s\n' % rule)
+        return filename
+
+    def __str__(self):
+        return ', '.join(self.rules())
+
+
+if __name__ == "__main__":
+    pass
@@ -12,55 +12,154 @@ __application__ = '__rsync__'    # we don't have a name yet...
 
 import sys
 import os
-import re
 import glob
+import json
+import time
+import select
+import shlex
+import socket
 import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from application.application import syscall
+from rsync.planner import transfer_plan
+from rsync.excludes import exclude_filter, builtin_excludes
+from rsync.stats import transfer_result
+from rsync.tuning import link_tuner
+from rsync.localcopy import local_copy
+from rsync.sshmaster import get_master
 
 #logger = logging.getLogger(__application__).addHandler(logging.NullHandler())
 
+
 #logger = logging.getLogger()
 
 
+def quote_path(path):
+    """A path quoted for the shell, a leading ~/ left for the shell to
+    expand."""
+    if path == '~' or path.startswith('~/'):
+        rest = path[2:]
+        return '~/%s' % shlex.quote(rest) if rest else '~'
+    return shlex.quote(path)
+
+
 class connection:
-    """ A class to verify, establish and re-establish the vpn connection """
+    """ A class to verify the remote host can be reached. A TCP connect to
+        the ssh port, with a short timeout, tells us more than ping ever did
+        and works for hosts that drop ICMP. Good answers are cached on disk
+        for a while so back to back runs don't probe at all. """
+
+    def __init__(self, logger=None, port=22, timeout=2.0, ttl=300, cache_file=None):
+        self.port = port
+        self.timeout = timeout
+        self.ttl = ttl
 
-    def __init__(self, logger=None):
-        self.ping_stats = re.compile('^([0-9]*) packets transmitted, ([0-9]*) packets received, ([0-9]*)\% packet loss', re.S)
-        self.ping_unknown = re.compile('unknown host', re.S)
+        if cache_file is None:
+            cache_file = os.path.join(os.getenv('HOME') or tempfile.gettempdir(),
+                                      '.PMhosts')
+        self.cache_file = cache_file
 
         if logger is None:
-            self.logger = logging.getLogger(__application__).addHandler(logging.NullHandler())
+            self.logger = logging.getLogger(__application__)
         else:
             self.logger = logger
 
+    def load_cache(self):
+        try:
+            with open(self.cache_file) as cache:
+                return json.load(cache)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def save_cache(self, hosts):
+        """Record the hosts we reached just now."""
+        if not hosts:
+            return
+        cache = self.load_cache()
+        now = time.time()
+        for host in hosts:
+            cache[host] = now
+        try:
+            temp_file = "%s.%d" % (self.cache_file, os.getpid())
+            with open(temp_file, 'w') as new_cache:
+                json.dump(cache, new_cache)
+            os.replace(temp_file, self.cache_file)
+        except (IOError, OSError) as e:
+            self.logger.debug("Could not write host cache %s: %s" %
+                              (self.cache_file, e))
+
+    def cached(self, host, cache=None):
+        if cache is None:
+            cache = self.load_cache()
+        return time.time() - cache.get(host, 0) < self.ttl
+
+    def probe(self, destination_host):
+        """Try a non-blocking connect to the ssh port. True if it answers."""
+        # user@host is what rsync and ssh want, we just want the host.
+        host = destination_host.split('@')[-1]
+        try:
+            addresses = socket.getaddrinfo(host, self.port, 0, socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            self.logger.info("unknown host %s: %s" % (host, e))
+            return False
+
+        for family, socktype, proto, name, address in addresses:
+            sock = socket.socket(family, socktype, proto)
+            sock.setblocking(False)
+            try:
+                sock.connect_ex(address)
+                readable, writable, errors = select.select([], [sock], [sock],
+                                                           self.timeout)
+                if writable and not sock.getsockopt(socket.SOL_SOCKET,
+                                                    socket.SO_ERROR):
+                    return True
+            except (OSError, ValueError):
+                pass
+            finally:
+                sock.close()
+
+        self.logger.error("Could not connect to %s port %s" % (host, self.port))
+        return False
+
     def check_connection(self, destination_host):
         """ Check to make sure the remote host can be found"""
         # check to make sure the host can be connected to.
         if destination_host is None:
             return True
-
-        for ping_output in os.popen("ping -c 2 %s 2>&1" % destination_host):
-
-            if self.ping_unknown.search(ping_output):
-                self.logger.info(ping_output)
-                return False
-
-            match = self.ping_stats.match(ping_output)
-            if match:
-                trans, received, loss = match.group(1), match.group(2), match.group(3)
-                self.logger.error("%s transmitted, %s Received, %s %% loss" % (trans, received, loss))
-                if loss == '100':
-                    self.logger.error("Not connected")
-                    return False
-
-        return True
+        return self.check_connections([destination_host])[destination_host]
+
+    def check_connections(self, destination_hosts):
+        """ Check a list of hosts at the same time. Returns a dictionary
+        of host: reachable."""
+        cache = self.load_cache()
+        results = {}
+        to_probe = []
+        for host in destination_hosts:
+            if host in (None, 'localhost') or self.cached(host, cache):
+                results[host] = True
+            elif host not in to_probe:
+                to_probe.append(host)
+
+        if len(to_probe) == 1:
+            results[to_probe[0]] = self.probe(to_probe[0])
+        elif to_probe:
+            with ThreadPoolExecutor(max_workers=len(to_probe)) as pool:
+                for host, reachable in zip(to_probe, pool.map(self.probe, to_probe)):
+                    results[host] = reachable
+
+        self.save_cache([host for host in to_probe if results[host]])
+        for host in results:
+            if not results[host]:
+                self.logger.error("Not connected to %s" % host)
+        return results
 
 
 class rsync:
 
     def __init__(self, cmd=None, logger=None, remote_directory=None, remote_host=None,
-                 local_dir=None, excludes=None):
+                 local_dir=None, excludes=None, parallelism=1, ssh_port=22,
+                 check=True, tuning=None, delete=False):
 
         #self.current_directory = os.getcwd()
         self.current_directory = local_dir
@@ -79,48 +178,78 @@ class rsync:
         else:
             self.logger = logger
 
-        # lead with a space so we get a --exclude after it with the join.
-        self.excludes = ["'.git'", "'.CVS'", "'.com'", "'.obj'"]
+        # the built in excludes, and whatever we are given, as one filter.
+        self.filter = exclude_filter(builtin_excludes, excludes)
+        self.excludes = self.filter.patterns
 
         # Set up the rsync command variables.
-        if excludes is not None:
-            self.excludes.append(excludes)
         self.parent_dir = local_dir
         self.remote_host = remote_host
+        # copy in process when the other end is here.
+        self.local = remote_host in (None, 'localhost')
+
+        # files gone from here are only deleted on the host when asked.
+        self.delete = delete
+
+        # how many transfers we run at once.
+        try:
+            self.parallelism = max(1, int(parallelism))
+        except (TypeError, ValueError):
+            self.parallelism = 1
+        self.ssh = None
         if self.remote_host == 'localhost':
             self.remote_host = None
             self.remote_host_directory = self.remote_directory
         else:
             self.remote_host_directory = "%s:%s" % (self.remote_host, self.remote_directory)
+            # everything to this host shares one ssh connection.
+            self.ssh = get_master(self.remote_host, self.logger)
+        # always the contents of the directory, never the directory itself,
+        # whichever way we go and however devPath was written.
+        if not self.remote_host_directory.endswith('/'):
+            self.remote_host_directory += '/'
+
+        if check and connection(self.logger, ssh_port).check_connection(self.remote_host) is False:
+            sys.exit()
 
         # take out the q's and put in v's for verbosity.
-        self.logger.debug("Excludes: %s" % self.excludes)
-        if self.excludes:
-            exclude_string = " --exclude ".join(self.excludes)
-        self.command = ("rsync -azvuK %s" % exclude_string)
-        self.simple_command = 'rsync -uazvK '
-
-        if connection(self.logger).check_connection(self.remote_host) is False:
-            sys.exit()
+        self.logger.debug("Excludes: %s" % self.filter)
+        # compression and friends depend on the link to the host.
+        tuner = link_tuner(self.remote_host, self.ssh, self.logger, tuning, ssh_port)
+        if self.cmd.no_execute:
+            options = tuner.options(tuner.choose({'rtt': None, 'throughput': None}))
+        else:
+            options = tuner.options()
+        # argument lists, no shell in the way.
+        self.base_command = ['rsync', '-avuK'] + options.split()
+        if self.ssh is not None:
+            self.base_command += ['-e', self.ssh.ssh_command()]
+        self.simple_command = self.base_command
+
+    def remote_command(self, command):
+        """A command line to run command on the remote host in our remote
+        directory, over the shared ssh connection."""
+        command = "cd %s && %s" % (quote_path(self.remote_directory), command)
+        if self.ssh is None:
+            return command
+        return self.ssh.remote_command(command)
 
     def get_directory(self, directory=None):
         """rsync a directory from the host."""
         #rsync -avz defender:pp/$1/sup ~/pp/$1
         try:
-            remote_path = os.path.join(self.remote_host_directory, directory),
+            remote_path = os.path.join(self.remote_host_directory, directory)
         except:
             remote_path = self.remote_host_directory
-        command = "%s %s %s" % (self.command, remote_path,
-                                self.current_directory.replace(' ', '\ '))
-        self.cmd.run(command)
+        return self.transfer_excluding([remote_path, self.current_directory])
 
     def get_pattern(self, pattern):
         """rsync a file pattern from the host"""
         #rsync -avz defender:/pp/$1/*.sas  ~/pp/$1
-        command = "%s %s %s" % (self.simple_command,
-                                os.path.join(self.remote_host_directory, pattern),
-                                self.current_directory)
-        self.cmd.run(command)
+        # the remote shell expands the pattern.
+        return self.transfer(self.simple_command +
+                             [os.path.join(self.remote_host_directory, pattern),
+                              self.current_directory])
 
     def send_directory(self, directory=None):
         """rsync a directory _to_ the host if it's here"""
@@ -132,38 +261,87 @@ class rsync:
             # directory on the other end.
             if directory[-1] != '/':
                 directory = "%s/" % directory
-            command = "%s %s %s" % (self.command, directory.replace(' ', '\ '),
-                                    self.remote_host_directory)
-            self.cmd.run(command)
+            return self.transfer_excluding([directory, self.remote_host_directory])
 
     def send_pattern(self, pattern):
         """rsync a file _to_ the host if it's here"""
-        if glob.glob(pattern):
+        files = glob.glob(pattern)
+        if files:
             #logger.info(pattern)
             #rsync -avz *.xml locutus:pp/$pp/
-            command = "%s ./%s %s" % (self.simple_command, pattern, self.remote_host_directory)
-            self.cmd.run(command)
+            return self.transfer(self.simple_command +
+                                 ['./%s' % f for f in sorted(files)] +
+                                 [self.remote_host_directory])
 
     def send_directories(self, directories):
-        """Send directories to the remote host"""
+        """Send directories to the remote host, several at a time"""
         #logger.info("Directories: %s" % directories)
-        if len(directories):
-            for directory in directories:
-                self.send_directory(os.path.join(self.current_directory, directory))
-        else:
-            self.send_directory()
+        return self.send_plans(self.plans(directories))
 
     def send_file(self, file):
         """Send files to the remote host"""
         self.logger.info("Send File %s" % file)
+        if self.local and os.path.isfile(file):
+            return self.send_paths([file])
         if os.path.isfile(file):
             #rsync -avz --exclude com/ --exclude obj/ --exclude sio/ ods locutus:pp/$pp
             # Add a slash on the end if there isn't one so we don't create the
             # directory on the other end.
             extend_path = os.path.dirname(file)
             remote_path = os.path.join(self.remote_host_directory, extend_path)
-            command = "%s %s %s" % (self.command, file, remote_path)
-            self.cmd.run(command)
+            return self.transfer_excluding([file, remote_path])
+
+    def send_paths(self, paths, deleted=None):
+        """Send just these paths, relative to the top of the project, in one
+        rsync. Deleted paths are deleted on the host as well, if we delete."""
+        deleted = (deleted or []) if self.delete else []
+        if not len(paths) and not len(deleted):
+            self.logger.info("Nothing to send")
+            return transfer_result(self.remote_host_directory)
+
+        if self.local:
+            return self.local_copy(self.current_directory, self.remote_directory
+                                   ).sync_paths(paths, deleted, self.excludes)
+
+        fd, list_file = tempfile.mkstemp(prefix='PMfiles.', suffix='.list')
+        with os.fdopen(fd, 'w') as files_from:
+            for path in list(paths) + list(deleted):
+                files_from.write('%s\n' % path)
+
+        directory = self.current_directory
+        if directory[-1] != '/':
+            directory = "%s/" % directory
+        command = self.base_command + ['--files-from=%s' % list_file]
+        if deleted:
+            command.append('--delete-missing-args')
+        try:
+            return self.transfer(command + [directory, self.remote_host_directory])
+        finally:
+            os.remove(list_file)
+
+    def get_paths(self, paths):
+        """Get just these paths, relative to the top of the remote
+        directory, in one rsync."""
+        if not len(paths):
+            self.logger.info("Nothing to get")
+            return transfer_result(self.remote_host_directory)
+
+        if self.local:
+            return self.local_copy(self.remote_directory,
+                                   self.current_directory).sync_paths(paths)
+
+        fd, list_file = tempfile.mkstemp(prefix='PMfiles.', suffix='.list')
+        with os.fdopen(fd, 'w') as files_from:
+            for path in paths:
+                files_from.write('%s\n' % path)
+
+        try:
+            return self.transfer(self.base_command +
+                                 ['--files-from=%s' % list_file,
+                                  self.remote_host_directory,
+                                  self.current_directory])
+        finally:
+            os.remove(list_file)
 
     def send_files(self, files):
         """Send files to the remote host"""
@@ -172,14 +350,10 @@ class rsync:
             self.send_pattern(pattern)
 
     def get_directories(self, directories):
-        """Get directories from the remote host"""
+        """Get directories from the remote host, several at a time.
+        The whole tree comes down, the directories are just split out."""
         self.logger.info("Get Directories")
-        self.get_directory()
-        try:
-            for directory in directories:
-                self.get_directory(directory)
-        except:
-            self.get_directory()
+        return self.get_plans(self.plans(directories, whole_tree=True))
 
     def get_files(self, files):
         """Get files from the remote host"""
@@ -187,5 +361,137 @@ class rsync:
         for pattern in files:
             self.get_pattern(pattern)
 
+    def local_copy(self, source, destination):
+        """The in process copy engine, for when the host is this one."""
+        return local_copy(source, destination, self.logger,
+                          max(self.parallelism, 4), self.cmd.no_execute)
+
+    def transfer(self, command, name='.'):
+        """Run an rsync command with --stats and --itemize-changes and
+        parse what it tells us into a transfer result."""
+        command = command[:1] + ['--stats', '--itemize-changes'] + command[1:]
+        call = self.cmd.capture(command)
+        prefix = '%s: ' % self.remote_host if self.remote_host else ''
+        for line in call.output.splitlines():
+            if line:
+                self.logger.debug("%s%s" % (prefix, line))
+        for line in call.errors.splitlines():
+            if line:
+                self.logger.error("%s%s" % (prefix, line))
+
+        result = transfer_result.parse(call.output, call.status, call.duration,
+                                       '%s%s' % (prefix, name))
+        self.logger.info(result)
+        return result
+
+    def transfer_excluding(self, arguments, name='.'):
+        """Transfer with our excludes, written out just for this rsync."""
+        with self.filter.exclude_from() as exclude_file:
+            return self.transfer(self.base_command +
+                                 ['--exclude-from=%s' % exclude_file] + arguments, name)
+
+    def plan(self, directories=None, patterns=None, whole_tree=None):
+        """Build a transfer plan with our excludes"""
+        return transfer_plan(directories, patterns, self.excludes, whole_tree)
+
+    def run_plan(self, plan, source, destination, name='.', options=()):
+        """rsync everything in the plan from source to destination in
+        a single invocation, using a filter file for the plan's rules."""
+        self.logger.debug("Transfer plan: %s" % plan)
+        filter_file = plan.write()
+        try:
+            return self.transfer(self.base_command + list(options) +
+                                 ['--filter=merge %s' % filter_file,
+                                  source, destination], name)
+        finally:
+            os.remove(filter_file)
+
+    def send_plan(self, plan, name='.'):
+        """Send the plan to the host in one rsync"""
+        if self.local:
+            return self.local_copy(self.current_directory,
+                                   self.remote_directory).sync_plan(plan, name,
+                                                                    self.delete)
+        directory = self.current_directory
+        # trailing slash so we don't create the directory on the other end.
+        if directory[-1] != '/':
+            directory = "%s/" % directory
+        # excluded files on the host are left alone.
+        return self.run_plan(plan, directory, self.remote_host_directory, name,
+                             ['--delete'] if self.delete else [])
+
+    def get_plan(self, plan, name='.'):
+        """Get the plan from the host in one rsync"""
+        if self.local:
+            return self.local_copy(self.remote_directory,
+                                   self.current_directory).sync_plan(plan, name)
+        return self.run_plan(plan, self.remote_host_directory,
+                             self.current_directory, name)
+
+    def plans(self, directories=None, patterns=None, whole_tree=False):
+        """Split a transfer into named plans that can run at the same
+        time. With a parallelism of one it's a single plan, otherwise
+        there is a plan for each directory and one for whatever is left."""
+        directories = self.plan(directories).directories
+        if whole_tree:
+            directories = ['.'] + directories
+
+        if self.parallelism < 2 or len(directories) < 2:
+            return [('.', self.plan(directories, patterns))]
+
+        plans = []
+        rest = self.plan(None, patterns, whole_tree=whole_tree)
+        for directory in directories:
+            if directory == '.':
+                continue
+            plans.append((directory, self.plan([directory])))
+            rest.exclude_directory(directory)
+
+        if whole_tree or rest.patterns:
+            plans.append(('.', rest))
+        return plans
+
+    def run_plans(self, plans, run):
+        """Run each plan with run, parallelism at a time. Returns the sum
+        of the results and logs each directory that failed."""
+        if len(plans) == 1:
+            results = [run(plans[0][1], plans[0][0])]
+        else:
+            with ThreadPoolExecutor(max_workers=self.parallelism) as pool:
+                results = list(pool.map(run, [plan for name, plan in plans],
+                                        [name for name, plan in plans]))
+
+        total = transfer_result(self.remote_host_directory)
+        failures = 0
+        for (name, plan), result in zip(plans, results):
+            if result.status:
+                failures += 1
+                self.logger.error("Transfer of %s failed with status %s" %
+                                  (name, result.status))
+            total.add(result)
+        if failures:
+            self.logger.error("%d of %d transfers failed" % (failures, len(plans)))
+        if len(plans) > 1:
+            self.logger.info(total)
+        return total
+
+    def send_plans(self, plans):
+        return self.run_plans(plans, self.send_plan)
+
+    def get_plans(self, plans):
+        return self.run_plans(plans, self.get_plan)
+
+    def send_all(self, directories, files):
+        """Send directories and file patterns in as few transfers as we can"""
+        self.logger.info("Send All")
+        return self.send_plans(self.plans(directories, files))
+
+    def get_all(self, directories, files):
+        """Get directories and file patterns in as few transfers as we can.
+        A get has always pulled the whole tree before the directories,
+        so the directories and patterns fold into it."""
+        self.logger.info("Get All")
+        return self.get_plans(self.plans(directories, files, whole_tree=True))
+
 if __name__ == "__main__":
     pass
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+   Shared, multiplexed ssh connections. Every ssh and rsync call to a host
+   goes through one OpenSSH ControlMaster socket so we only pay for the
+   key exchange and login once per host. The master is started lazily by
+   the first command that uses it and shut down when the process exits.
+"""
+
+__author__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__support__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__version__ = '$Revision: 1 $'[11:-2]
+__application__ = '__rsync__'
+
+import os
+import atexit
+import shutil
+import logging
+import tempfile
+import subprocess
+
+# one master per host, for the life of the process.
+masters = {}
+socket_dir = None
+socket_dir_owner = None
+
+# how long a master waits, idle, before it goes away. A long running
+# process, like the daemon, turns this up.
+default_persist = '60s'
+
+
+def get_socket_dir():
+    """The private directory our control sockets live in."""
+    global socket_dir, socket_dir_owner
+    if socket_dir is None:
+        socket_dir = tempfile.mkdtemp(prefix='PMssh.')
+        socket_dir_owner = os.getpid()
+        os.chmod(socket_dir, 0o700)
+    return socket_dir
+
+
+def get_master(host, logger=None, persist=None):
+    """Get the master connection for a host, creating it if needed."""
+    if host not in masters:
+        masters[host] = sshmaster(host, logger=logger,
+                                  persist=persist or default_persist)
+    return masters[host]
+
+
+def close_all():
+    """Shut down every master connection and remove the socket directory.
+    In a process forked from the one that made the socket directory, a
+    daemon request, the masters are left running for the next one, and
+    the owner stops them all when it goes."""
+    global socket_dir
+    if socket_dir is not None and socket_dir_owner != os.getpid():
+        masters.clear()
+        return
+    for host in list(masters):
+        masters.pop(host).stop()
+    if socket_dir is not None:
+        # masters started by processes we forked, named %r@%h:%p.
+        try:
+            names = os.listdir(socket_dir)
+        except OSError:
+            names = []
+        for name in names:
+            sshmaster(name.rsplit(':', 1)[0], directory=socket_dir,
+                      control_path=os.path.join(socket_dir, name)).stop()
+        shutil.rmtree(socket_dir, ignore_errors=True)
+        socket_dir = None
+
+atexit.register(close_all)
+
+
+class sshmaster:
+    """ A multiplexed ssh master connection to one host. Nothing is started
+        until a command uses the options. ControlMaster=auto makes the first
+        ssh the master, and ControlPersist keeps it around in the background
+        for everyone after it. """
+
+    def __init__(self, host, logger=None, persist='60s', directory=None,
+                 control_path=None):
+        self.host = host
+        self.persist = persist
+
+        if logger is None:
+            self.logger = logging.getLogger(__application__)
+        else:
+            self.logger = logger
+
+        if directory is None:
+            directory = get_socket_dir()
+        self.control_path = control_path or os.path.join(directory, '%r@%h:%p')
+
+    def options(self):
+        """The ssh options that put a command on the shared connection."""
+        return ("-o ControlMaster=auto -o ControlPath=%s -o ControlPersist=%s" %
+                (self.control_path, self.persist))
+
+    def ssh_command(self):
+        """ssh, ready to use the shared connection. Good for rsync -e too."""
+        return "ssh %s" % self.options()
+
+    def remote_command(self, command):
+        """An ssh command line that runs command on the host."""
+        return "%s %s %s" % (self.ssh_command(), self.host,
+                             "'%s'" % command.replace("'", "'\\''"))
+
+    def control(self, operation):
+        """Send a control command to the master, -O check or -O exit."""
+        return subprocess.call(['ssh', '-o', 'ControlPath=%s' % self.control_path,
+                                '-O', operation, self.host],
+                               stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+
+    def is_running(self):
+        return self.control('check') == 0
+
+    def start(self):
+        """Start the master now rather than waiting for the first command."""
+        if self.is_running():
+            return True
+        self.logger.debug("Starting ssh master for %s" % self.host)
+        return subprocess.call(['ssh', '-o', 'ControlMaster=yes',
+                                '-o', 'ControlPath=%s' % self.control_path,
+                                '-o', 'ControlPersist=%s' % self.persist,
+                                '-f', '-N', self.host]) == 0
+
+    def stop(self):
+        """Shut down the master if one is running."""
+        if self.is_running():
+            self.logger.debug("Stopping ssh master for %s" % self.host)
+            self.control('exit')
+
+
+if __name__ == "__main__":
+    pass
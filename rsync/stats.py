@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+   The results of an rsync, parsed out of its --stats and --itemize-changes
+   output. Enough to tell whether a slow transfer was slow on the network,
+   building the file list, or computing deltas.
+"""
+
+__author__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__support__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__version__ = '$Revision: 1 $'[11:-2]
+
+import re
+
+
+class transfer_result:
+    """ One rsync, or the sum of several. """
+
+    # attribute, regex for the --stats line it comes from.
+    stats_lines = [
+        ('files_considered', re.compile('^Number of files: ([0-9,]+)')),
+        ('files_transferred', re.compile('^Number of (?:regular )?files transferred: ([0-9,]+)')),
+        ('total_size', re.compile('^Total file size: ([0-9,]+)')),
+        ('transferred_size', re.compile('^Total transferred file size: ([0-9,]+)')),
+        ('literal_bytes', re.compile('^Literal data: ([0-9,]+)')),
+        ('matched_bytes', re.compile('^Matched data: ([0-9,]+)')),
+        ('file_list_size', re.compile('^File list size: ([0-9,]+)')),
+        ('file_list_time', re.compile('^File list generation time: ([0-9.]+)')),
+        ('file_list_transfer_time', re.compile('^File list transfer time: ([0-9.]+)')),
+        ('bytes_sent', re.compile('^Total bytes sent: ([0-9,]+)')),
+        ('bytes_received', re.compile('^Total bytes received: ([0-9,]+)')),
+        ('speedup', re.compile('^total size is [0-9,]+ +speedup is ([0-9.,]+)')),
+    ]
+
+    # >f+++++++++ some/file, *deleting some/other/file, etc.
+    itemized_line = re.compile('^([<>ch.*][fdLDS][^ ]*|[*]deleting) +(.*)$')
+
+    def __init__(self, name='.', status=0):
+        self.name = name
+        self.status = status
+        self.transfers = 0
+        self.files_considered = 0
+        self.files_transferred = 0
+        self.total_size = 0
+        self.transferred_size = 0
+        self.literal_bytes = 0
+        self.matched_bytes = 0
+        self.file_list_size = 0
+        self.file_list_time = 0.0
+        self.file_list_transfer_time = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.speedup = 0.0
+        self.wall_time = 0.0
+        self.changes = []
+
+    @classmethod
+    def parse(cls, output, status=0, wall_time=0.0, name='.'):
+        """Build a result from rsync's output."""
+        result = cls(name, status)
+        result.transfers = 1
+        result.wall_time = wall_time
+        for line in output.splitlines():
+            line = line.strip()
+            match = cls.itemized_line.match(line)
+            if match:
+                result.changes.append((match.group(1), match.group(2)))
+                continue
+            for attribute, regex in cls.stats_lines:
+                match = regex.match(line)
+                if match:
+                    value = match.group(1).replace(',', '')
+                    if isinstance(getattr(result, attribute), float):
+                        setattr(result, attribute, float(value))
+                    else:
+                        setattr(result, attribute, int(value))
+                    break
+        return result
+
+    def add(self, other):
+        """Add another result to this one. Times add up, except wall time
+        which is the longest, since we run transfers side by side."""
+        self.status = self.status or other.status
+        self.transfers += other.transfers
+        for attribute, regex in self.stats_lines:
+            if attribute != 'speedup':
+                setattr(self, attribute,
+                        getattr(self, attribute) + getattr(other, attribute))
+        self.wall_time = max(self.wall_time, other.wall_time)
+        self.changes.extend(other.changes)
+        moved = self.bytes_sent + self.bytes_received
+        self.speedup = float(self.total_size) / moved if moved else 0.0
+        return self
+
+    @property
+    def transferred(self):
+        """Bytes that went across. rsync says what it sent and received, a
+        local copy only knows what it wrote, its literal bytes."""
+        return (self.bytes_sent + self.bytes_received) or self.literal_bytes
+
+    def as_dict(self):
+        values = dict(vars(self))
+        values['changes'] = len(self.changes)
+        values['transferred'] = self.transferred
+        return values
+
+    def __str__(self):
+        return ("%s: status %s, %d transfers, %d of %d files, "
+                "%d literal %d matched bytes, %d sent %d received, "
+                "speedup %.2f, file list %.3fs, wall %.2fs" %
+                (self.name, self.status, self.transfers,
+                 self.files_transferred, self.files_considered,
+                 self.literal_bytes, self.matched_bytes,
+                 self.bytes_sent, self.bytes_received, self.speedup,
+                 self.file_list_time, self.wall_time))
+
+
+if __name__ == "__main__":
+    pass
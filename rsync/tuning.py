@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+   Pick rsync's compression, whole file and block size options to suit the
+   link to each host. The round trip time and throughput to a host are
+   measured over its shared ssh connection and cached on disk, and any of
+   the choices can be overridden in the project's config section. A host
+   that can't be measured is cached too, for a shorter time, so it isn't
+   measured again by every rsync we make for it.
+"""
+
+__author__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__support__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__version__ = '$Revision: 1 $'[11:-2]
+__application__ = '__rsync__'
+
+import os
+import json
+import time
+import socket
+import logging
+import tempfile
+import subprocess
+from rsync.planner import split_list
+
+# Things that are already compressed. Squeezing them again just burns CPU.
+skip_compress = ['7z', 'avi', 'bz2', 'deb', 'gif', 'gz', 'iso', 'jpeg', 'jpg',
+                 'm4a', 'm4v', 'mkv', 'mov', 'mp3', 'mp4', 'ogg', 'pdf', 'png',
+                 'rar', 'rpm', 'sas7bdat', 'tbz', 'tgz', 'xz', 'z', 'zip', 'zst']
+
+# Link speeds in bytes per second and round trips in seconds.
+lan_throughput = 50 * 1024 * 1024
+fast_throughput = 10 * 1024 * 1024
+lan_rtt = 0.002
+
+
+class link_tuner:
+    """ Measures the link to a host and turns it into rsync options.
+        overrides come from the config, compress, compressLevel,
+        skipCompress, wholeFile and blockSize, with the keys in lower case
+        like configparser gives them to us. """
+
+    def __init__(self, host, ssh=None, logger=None, overrides=None, port=22,
+                 ttl=86400, failed_ttl=3600, sample_size=4 * 1024 * 1024,
+                 sample_time=2, cache_file=None):
+        self.host = host
+        self.ssh = ssh
+        self.port = port
+        self.ttl = ttl
+        self.failed_ttl = failed_ttl
+        self.sample_size = sample_size
+        self.sample_time = sample_time
+        self.overrides = overrides or {}
+
+        if cache_file is None:
+            cache_file = os.path.join(os.getenv('HOME') or tempfile.gettempdir(),
+                                      '.PMlinks')
+        self.cache_file = cache_file
+
+        if logger is None:
+            self.logger = logging.getLogger(__application__)
+        else:
+            self.logger = logger
+
+    def load_cache(self):
+        try:
+            with open(self.cache_file) as cache:
+                return json.load(cache)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def save_cache(self, link):
+        cache = self.load_cache()
+        cache[self.host] = link
+        try:
+            temp_file = "%s.%d" % (self.cache_file, os.getpid())
+            with open(temp_file, 'w') as new_cache:
+                json.dump(cache, new_cache)
+            os.replace(temp_file, self.cache_file)
+        except (IOError, OSError) as e:
+            self.logger.debug("Could not write link cache %s: %s" %
+                              (self.cache_file, e))
+
+    def measure_rtt(self, tries=3):
+        """Best of a few TCP connects to the ssh port. One that fails is
+        enough, an alias or a filtered port won't do better next time."""
+        best = None
+        for i in range(tries):
+            start = time.time()
+            try:
+                sock = socket.create_connection((self.host.split('@')[-1], self.port),
+                                                timeout=2)
+                sock.close()
+            except OSError:
+                break
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        return best
+
+    def measure_throughput(self):
+        """Time pulling a sample of incompressible bytes over ssh. The
+        sample stops at sample_size bytes or sample_time seconds, whichever
+        comes first, and the speed is what arrived in the time it took."""
+        if self.ssh is None:
+            return None
+        # a host that never answers gets this long, all told.
+        limit = self.sample_time + 5
+        try:
+            # get the master up first so the handshake isn't part of the time.
+            if subprocess.call("%s %s true" % (self.ssh.ssh_command(), self.host),
+                               shell=True, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL, timeout=limit):
+                return None
+            command = ("%s %s 'timeout %d head -c %d /dev/urandom'" %
+                       (self.ssh.ssh_command(), self.host, self.sample_time,
+                        self.sample_size))
+        except subprocess.TimeoutExpired:
+            return None
+
+        start = time.time()
+        received = 0
+        # counted as it comes and thrown away, a fast link sends a lot.
+        sample = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE,
+                                  stderr=subprocess.DEVNULL)
+        with sample.stdout:
+            for chunk in iter(lambda: sample.stdout.read(65536), b''):
+                received += len(chunk)
+                if time.time() - start > limit:
+                    break
+        elapsed = time.time() - start
+        if sample.poll() is None:
+            sample.kill()
+        sample.wait()
+        if not received:
+            return None
+        return received / max(elapsed, 0.000001)
+
+    def fresh(self, link):
+        """A cached link is good for ttl, or failed_ttl if we couldn't
+        measure all of it."""
+        measured = link.get('rtt') is not None and link.get('throughput') is not None
+        ttl = self.ttl if measured else self.failed_ttl
+        return time.time() - link.get('time', 0) < ttl
+
+    def link(self):
+        """The rtt and throughput to the host, from the cache if we can."""
+        cache = self.load_cache()
+        link = cache.get(self.host)
+        if link and self.fresh(link):
+            return link
+
+        link = {'rtt': self.measure_rtt(),
+                'throughput': self.measure_throughput(),
+                'time': time.time()}
+        self.logger.debug("Link to %s: %s" % (self.host, link))
+        self.save_cache(link)
+        return link
+
+    def override(self, name):
+        return self.overrides.get(name.lower())
+
+    def override_flag(self, name):
+        value = self.override(name)
+        if value is None:
+            return None
+        if isinstance(value, str):
+            return value.strip().lower() in ('1', 'yes', 'true', 'on')
+        return bool(value)
+
+    def choose(self, link=None):
+        """Decide compression, level, whole file and block size."""
+        choice = {'compress': True, 'compress_level': 6, 'whole_file': False,
+                  'block_size': None,
+                  'skip_compress': list(skip_compress)}
+
+        if link is None:
+            link = self.link() if self.host else {'rtt': 0, 'throughput': None}
+        rtt = link.get('rtt')
+        throughput = link.get('throughput')
+
+        if self.host is None:
+            # a local copy, nothing to gain from compression or deltas.
+            choice['compress'] = False
+            choice['whole_file'] = True
+        elif throughput is not None:
+            if throughput >= lan_throughput and rtt is not None and rtt <= lan_rtt:
+                # the disk is slower than the wire, just copy.
+                choice['compress'] = False
+                choice['whole_file'] = True
+            elif throughput >= lan_throughput:
+                choice['compress'] = False
+                choice['block_size'] = 131072
+            elif throughput >= fast_throughput:
+                # cheap compression, bigger blocks mean fewer checksums.
+                choice['compress_level'] = 1
+                choice['block_size'] = 32768
+
+        flag = self.override_flag('compress')
+        if flag is not None:
+            choice['compress'] = flag
+        if self.override('compressLevel'):
+            choice['compress_level'] = int(self.override('compressLevel'))
+        if self.override('skipCompress'):
+            choice['skip_compress'] = split_list(self.override('skipCompress'))
+        flag = self.override_flag('wholeFile')
+        if flag is not None:
+            choice['whole_file'] = flag
+        if self.override('blockSize'):
+            choice['block_size'] = int(self.override('blockSize'))
+        return choice
+
+    def options(self, choice=None):
+        """The rsync command line options for the link."""
+        if choice is None:
+            choice = self.choose()
+        options = []
+        if choice['compress']:
+            options.append('-z --compress-level=%d' % choice['compress_level'])
+            if choice['skip_compress']:
+                options.append('--skip-compress=%s' % '/'.join(choice['skip_compress']))
+        if choice['whole_file']:
+            options.append('--whole-file')
+        elif choice['block_size']:
+            options.append('--block-size=%d' % choice['block_size'])
+        return ' '.join(options)
+
+
+if __name__ == "__main__":
+    pass
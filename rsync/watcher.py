@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+   Watch a project tree for changes. inotify is used when the inotify_simple
+   module is available, otherwise the tree is polled. Changes are collected
+   until things have been quiet for the debounce window and then handed
+   back as one batch, so a save of a dozen files is one rsync.
+"""
+
+__author__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__support__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__version__ = '$Revision: 1 $'[11:-2]
+__application__ = '__rsync__'
+
+import os
+import time
+import logging
+from rsync.manifest import manifest
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+
+class watcher:
+    """ Yields batches of changed paths, relative to the top of the tree. """
+
+    def __init__(self, path, excludes=None, logger=None, debounce=1.0,
+                 interval=1.0, polling=False):
+        self.path = path
+        self.debounce = debounce
+        self.interval = interval
+        self.polling = polling or INotify is None
+
+        if logger is None:
+            self.logger = logging.getLogger(__application__)
+        else:
+            self.logger = logger
+
+        # the manifest knows how to walk the tree and honour the excludes.
+        self.tree = manifest(path, None, excludes, self.logger)
+
+    def batches(self):
+        """Forever, yield a set of the paths that changed."""
+        if self.polling:
+            self.logger.info("Polling %s for changes" % self.path)
+            return self.poll()
+        self.logger.info("Watching %s for changes" % self.path)
+        return self.notify()
+
+    def poll(self):
+        """Compare a fresh scan to the last one every interval."""
+        last = self.tree.scan()
+        changed = set()
+        quiet_since = None
+        while True:
+            time.sleep(self.interval)
+            current = self.tree.scan()
+            found = set(p for p in current if last.get(p) != current[p])
+            found.update(p for p in last if p not in current)
+            last = current
+
+            if found:
+                changed.update(found)
+                quiet_since = time.time()
+            elif changed and time.time() - quiet_since >= self.debounce:
+                yield changed
+                changed = set()
+
+    def add_watches(self, inotify, watches, directory):
+        """Watch directory and everything below it that isn't excluded."""
+        mask = (flags.CREATE | flags.MODIFY | flags.DELETE | flags.CLOSE_WRITE |
+                flags.MOVED_FROM | flags.MOVED_TO | flags.ATTRIB)
+        found = []
+        stack = [directory]
+        while stack:
+            current = stack.pop()
+            try:
+                wd = inotify.add_watch(os.path.join(self.path, current), mask)
+            except OSError as e:
+                self.logger.debug("Could not watch %s: %s" % (current, e))
+                continue
+            watches[wd] = current
+            try:
+                entries = list(os.scandir(os.path.join(self.path, current)))
+            except OSError:
+                continue
+            for entry in entries:
+                relpath = os.path.join(current, entry.name) if current else entry.name
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if self.tree.excluded(entry.name, relpath, is_dir):
+                    continue
+                if is_dir:
+                    stack.append(relpath)
+                else:
+                    found.append(relpath)
+        return found
+
+    def notify(self):
+        """Read inotify events, debounced."""
+        inotify = INotify()
+        watches = {}
+        self.add_watches(inotify, watches, '')
+        changed = set()
+        while True:
+            # wait forever for the first event, then until things go quiet.
+            timeout = self.debounce * 1000 if changed else None
+            events = inotify.read(timeout=timeout)
+            if not events:
+                if changed:
+                    yield changed
+                    changed = set()
+                continue
+
+            for event in events:
+                directory = watches.get(event.wd)
+                if directory is None or not event.name:
+                    continue
+                relpath = os.path.join(directory, event.name) if directory else event.name
+                if self.tree.excluded(event.name, relpath,
+                                      bool(event.mask & flags.ISDIR)):
+                    continue
+                if event.mask & flags.ISDIR:
+                    if event.mask & (flags.CREATE | flags.MOVED_TO):
+                        # a new directory, watch it and send what's in it.
+                        changed.update(self.add_watches(inotify, watches, relpath))
+                    continue
+                changed.add(relpath)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+   PM batch, run for real against a throw away home directory and project,
+   and the exit status it leaves.
+"""
+
+__author__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__support__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__version__ = '$Revision: 1 $'[11:-2]
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+PM = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'PM.py')
+
+
+class test_batch(unittest.TestCase):
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp(prefix='PMtest.')
+        self.project = os.path.join(self.home, 'Projects', 'proj')
+        os.makedirs(self.project)
+        with open(os.path.join(self.home, '.PMrc'), 'w') as rc:
+            rc.write("[default]\n"
+                     "ProjectRoot = Projects\n"
+                     "ProjectBase = %s\n"
+                     "GitBase = %s\n"
+                     "LocalGit = GIT\n"
+                     "[proj]\n"
+                     "type = Project\n"
+                     "repository = local\n"
+                     "devHost = localhost\n"
+                     "devPath = %s\n"
+                     "directories =\n" % (self.home, self.home,
+                                          os.path.join(self.home, 'deployed')))
+        with open(os.path.join(self.project, '.PMrc.project'), 'w') as rc:
+            rc.write("[default]\nname = proj\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.home)
+
+    def batch(self, script):
+        env = dict(os.environ, HOME=self.home, PM_NO_DAEMON='1')
+        env.pop('XDG_CACHE_HOME', None)
+        process = subprocess.run([sys.executable, PM, 'batch'], input=script,
+                                 cwd=self.project, env=env,
+                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                 universal_newlines=True)
+        return process.returncode, process.stdout
+
+    def test_commands_without_a_project(self):
+        status, output = self.batch('reindex\ntag nothing_here --json\n')
+        self.assertNotIn("can't be run in a batch", output)
+        self.assertIn('1 project instances under', output)
+
+    def test_local_commands_are_refused(self):
+        status, output = self.batch('reindex\ndaemon --status\nbatch\n')
+        self.assertEqual(status, 1)
+        self.assertIn("daemon --status: can't be run in a batch", output)
+        self.assertIn("batch: can't be run in a batch", output)
+        self.assertIn('2 of 3 commands failed', output)
+        self.assertNotIn('Traceback', output)
+
+    def test_all_ok(self):
+        status, output = self.batch('reindex\n# a comment\n\nreindex\n')
+        self.assertEqual(status, 0, output)
+        self.assertIn('2 ok, 0 failed', output)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+   Finding the daemon, and what the client will and won't hand it.
+"""
+
+__author__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__support__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__version__ = '$Revision: 1 $'[11:-2]
+
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+from unittest import mock
+from application import client
+
+
+class test_client(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='PMtest.')
+        environ = dict(os.environ, TMPDIR=self.path)
+        environ.pop('XDG_RUNTIME_DIR', None)
+        self.environ = mock.patch.dict(os.environ, environ, clear=True)
+        self.environ.start()
+
+    def tearDown(self):
+        self.environ.stop()
+        shutil.rmtree(self.path)
+
+    def listen(self, path):
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen(1)
+        self.addCleanup(server.close)
+        return server
+
+    def test_private_directory(self):
+        path = client.socket_path('PMtest', create=True)
+        directory = os.path.dirname(path)
+        self.assertEqual(os.path.dirname(directory), self.path)
+        self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+        self.assertEqual(client.socket_path('PMtest'), path)
+
+    def test_directory_others_can_get_into(self):
+        path = client.socket_path('PMtest', create=True)
+        os.chmod(os.path.dirname(path), 0o777)
+        self.assertIsNone(client.socket_path('PMtest'))
+        self.assertIsNone(client.connect('PMtest'))
+
+    def test_no_directory(self):
+        self.assertIsNone(client.socket_path('PMtest'))
+        self.assertIsNone(client.connect('PMtest'))
+
+    def test_runtime_dir(self):
+        with mock.patch.dict(os.environ, {'XDG_RUNTIME_DIR': self.path}):
+            self.assertEqual(os.path.dirname(client.socket_path('PMtest')), self.path)
+
+    def test_connect(self):
+        self.listen(client.socket_path('PMtest', create=True))
+        connection = client.connect('PMtest')
+        self.assertIsNotNone(connection)
+        connection.close()
+
+    def test_not_a_socket(self):
+        path = client.socket_path('PMtest', create=True)
+        open(path, 'w').close()
+        self.assertIsNone(client.connect('PMtest'))
+
+    def test_somebody_elses_socket(self):
+        self.listen(client.socket_path('PMtest', create=True))
+        with mock.patch.object(client, 'private', return_value=False):
+            self.assertIsNone(client.connect('PMtest'))
+        with mock.patch.object(client, 'peer_is_us', return_value=False):
+            self.assertIsNone(client.connect('PMtest'))
+
+    def test_environment(self):
+        with mock.patch.dict(os.environ, {'HOME': '/home/me', 'LC_ALL': 'C',
+                                          'PMTEST_NO_DAEMON': '',
+                                          'GITHUB_TOKEN': 'secret',
+                                          'AWS_SECRET_ACCESS_KEY': 'secret'}):
+            environment = client.environment('PMtest')
+        self.assertEqual(environment['HOME'], '/home/me')
+        self.assertIn('LC_ALL', environment)
+        self.assertIn('PMTEST_NO_DAEMON', environment)
+        self.assertNotIn('GITHUB_TOKEN', environment)
+        self.assertNotIn('AWS_SECRET_ACCESS_KEY', environment)
+
+
+if __name__ == "__main__":
+    unittest.main()
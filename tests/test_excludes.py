@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+   rsync exclude patterns as regexes, and the merged filter.
+"""
+
+__author__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__support__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__version__ = '$Revision: 1 $'[11:-2]
+
+import os
+import re
+import unittest
+from rsync.excludes import translate, exclude_filter, builtin_excludes
+
+
+class test_translate(unittest.TestCase):
+
+    def matches(self, pattern, relpath):
+        return re.search(translate(pattern), relpath) is not None
+
+    def test_name_at_any_depth(self):
+        self.assertTrue(self.matches('*.o', 'main.o'))
+        self.assertTrue(self.matches('*.o', 'src/lib/main.o'))
+        self.assertFalse(self.matches('*.o', 'main.obj'))
+
+    def test_anchored(self):
+        self.assertTrue(self.matches('/tags', 'tags'))
+        self.assertFalse(self.matches('/tags', 'src/tags'))
+
+    def test_star_stays_in_its_directory(self):
+        self.assertTrue(self.matches('src/*.c', 'src/main.c'))
+        self.assertFalse(self.matches('src/*.c', 'src/lib/main.c'))
+        self.assertTrue(self.matches('src/**.c', 'src/lib/main.c'))
+
+    def test_triple_star(self):
+        self.assertTrue(self.matches('build/***', 'build'))
+        self.assertTrue(self.matches('build/***', 'build/obj/main.o'))
+        self.assertFalse(self.matches('build/***', 'builder'))
+
+    def test_character_classes(self):
+        self.assertTrue(self.matches('file?.[ch]', 'file1.c'))
+        self.assertFalse(self.matches('file?.[!ch]', 'file1.c'))
+
+    def test_literal_characters(self):
+        self.assertTrue(self.matches('a+b(1).txt', 'a+b(1).txt'))
+        self.assertFalse(self.matches('a.txt', 'abtxt'))
+
+
+class test_exclude_filter(unittest.TestCase):
+
+    def test_merged_without_duplicates(self):
+        excludes = exclude_filter(['.git', '*.o'], '*.o, build/')
+        self.assertEqual(excludes.patterns, ['.git', '*.o', 'build/'])
+
+    def test_directory_only_patterns(self):
+        excludes = exclude_filter(['build/'])
+        self.assertTrue(excludes.excluded('build', True))
+        self.assertFalse(excludes.excluded('build'))
+
+    def test_excluded_path_checks_parents(self):
+        excludes = exclude_filter(['build/'])
+        self.assertFalse(excludes.excluded('build/main.o'))
+        self.assertTrue(excludes.excluded_path('build/main.o'))
+
+    def test_pm_state_files(self):
+        excludes = exclude_filter(builtin_excludes)
+        for relpath in ['.PMmanifest', '.PMresults', '.PM.log', '.PM.log.1',
+                        'src/.main.c.PMcopy', 'tags.partial.123', 'tags.shard0.123']:
+            self.assertTrue(excludes.excluded(relpath), relpath)
+        self.assertFalse(excludes.excluded('src/main.c'))
+
+    def test_prune(self):
+        excludes = exclude_filter(['.git', 'build/'])
+        names = ['.git', 'build', 'src']
+        excludes.prune('', names)
+        self.assertEqual(names, ['src'])
+
+    def test_exclude_from(self):
+        excludes = exclude_filter(['*.o', 'build/'])
+        with excludes.exclude_from() as exclude_file:
+            with open(exclude_file) as f:
+                self.assertEqual(f.read(), '*.o\nbuild/\n')
+        self.assertFalse(os.path.exists(exclude_file))
+
+
+if __name__ == "__main__":
+    unittest.main()
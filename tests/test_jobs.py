@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+   Command lines for jobs on a host, run here through the shell the way the
+   host's would run them.
+"""
+
+__author__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__support__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__version__ = '$Revision: 1 $'[11:-2]
+
+import os
+import shlex
+import shutil
+import logging
+import tempfile
+import unittest
+import subprocess
+from application.application import syscall
+from rsync.rsync import rsync, quote_path
+from rsync.jobs import with_timeout
+
+
+class test_remote_command(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='PMtest.')
+        self.project = os.path.join(self.path, 'project')
+        self.deployed = os.path.join(self.path, "it's deployed")
+        os.makedirs(os.path.join(self.deployed, 'sub dir'))
+        os.makedirs(self.project)
+        logger = logging.getLogger('PMtest')
+        logger.addHandler(logging.NullHandler())
+        logger.propagate = False
+        self.rsync = rsync(syscall(logger), logger, self.deployed, 'localhost',
+                           self.project, check=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def shell(self, command):
+        return subprocess.run(command, shell=True, stdout=subprocess.PIPE,
+                              universal_newlines=True).stdout
+
+    def test_quote_path(self):
+        self.assertEqual(quote_path('pp/proj'), 'pp/proj')
+        self.assertEqual(quote_path('a b'), "'a b'")
+        self.assertEqual(quote_path('~'), '~')
+        self.assertEqual(quote_path('~/my pp'), "~/'my pp'")
+
+    def test_arguments_keep_their_quoting(self):
+        arguments = ['printf', '%s|', 'a b', "it's"]
+        command = ' '.join(shlex.quote(arg) for arg in arguments)
+        job = 'cd %s && %s' % (quote_path('sub dir'), command)
+        self.assertEqual(self.shell(self.rsync.remote_command(job)), "a b|it's|")
+
+    def test_in_the_remote_directory(self):
+        output = self.shell(self.rsync.remote_command('pwd'))
+        self.assertEqual(output.strip(), os.path.realpath(self.deployed))
+
+    def test_with_timeout(self):
+        job = with_timeout('cd %s && pwd' % quote_path('sub dir'), 5)
+        output = self.shell(self.rsync.remote_command(job))
+        self.assertEqual(output.strip(),
+                         os.path.realpath(os.path.join(self.deployed, 'sub dir')))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+   Deploying to localhost, which copies in process instead of running rsync.
+"""
+
+__author__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__support__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__version__ = '$Revision: 1 $'[11:-2]
+
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+from unittest import mock
+from application.application import syscall
+from rsync import localcopy
+from rsync.rsync import rsync
+
+
+def write(path, contents):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(contents)
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+class test_copy_file(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='PMtest.')
+        self.source = os.path.join(self.path, 'source')
+        self.destination = os.path.join(self.path, 'destination')
+        write(self.source, 'x' * 100000)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_copy(self):
+        self.assertEqual(localcopy.copy_file(self.source, self.destination), 100000)
+        self.assertEqual(read(self.destination), 'x' * 100000)
+        self.assertEqual(os.stat(self.source).st_mtime_ns,
+                         os.stat(self.destination).st_mtime_ns)
+
+    @unittest.skipUnless(hasattr(os, 'copy_file_range'), 'no copy_file_range')
+    def test_short_copy_falls_back(self):
+        # copy_file_range stops half way, the rest must still be copied.
+        calls = []
+
+        def short_copy(source_fd, destination_fd, count):
+            calls.append(count)
+            if len(calls) > 1:
+                return 0
+            os.write(destination_fd, os.read(source_fd, 1000))
+            return 1000
+
+        with mock.patch.object(localcopy, 'reflink', return_value=False), \
+                mock.patch.object(localcopy.os, 'copy_file_range', short_copy):
+            localcopy.copy_file(self.source, self.destination)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(read(self.destination), 'x' * 100000)
+
+    def test_no_temp_file_left_on_failure(self):
+        with mock.patch.object(localcopy.shutil, 'copymode', side_effect=OSError):
+            with self.assertRaises(OSError):
+                localcopy.copy_file(self.source, self.destination)
+        self.assertEqual(os.listdir(self.path), ['source'])
+
+
+class test_localhost_deploy(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='PMtest.')
+        self.project = os.path.join(self.path, 'project')
+        self.deployed = os.path.join(self.path, 'deployed')
+        write(os.path.join(self.project, 'src', 'main.c'), 'int main;\n')
+        write(os.path.join(self.project, 'doc', 'README'), 'read me\n')
+        write(os.path.join(self.project, 'build.xml'), '<build/>\n')
+        write(os.path.join(self.project, 'obj', 'main.o'), 'object')
+        write(os.path.join(self.project, '.PMmanifest'), '{}')
+        write(os.path.join(self.project, '.PM.log'), 'log')
+        os.makedirs(self.deployed)
+
+        self.logger = logging.getLogger('PMtest')
+        self.logger.addHandler(logging.NullHandler())
+        self.logger.propagate = False
+        self.cmd = syscall(self.logger)
+        self.cmd.no_execute = None
+        self.rsync = rsync(self.cmd, self.logger, self.deployed, 'localhost',
+                           self.project, ['obj/'], check=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def deployed_files(self):
+        files = []
+        for directory, dirs, names in os.walk(self.deployed):
+            files.extend(os.path.relpath(os.path.join(directory, name), self.deployed)
+                         for name in names)
+        return sorted(files)
+
+    def test_remote_directory_has_trailing_slash(self):
+        self.assertTrue(self.rsync.remote_host_directory.endswith('/'))
+        self.assertTrue(self.rsync.local)
+
+    def test_send_all(self):
+        result = self.rsync.send_all(['src'], ['*.xml'])
+        self.assertEqual(result.status, 0)
+        self.assertEqual(self.deployed_files(), ['build.xml', 'src/main.c'])
+        self.assertEqual(result.files_transferred, 2)
+
+    def test_send_whole_tree_skips_excludes_and_state(self):
+        result = self.rsync.send_all([], [])
+        self.assertEqual(result.status, 0)
+        self.assertEqual(self.deployed_files(), ['build.xml', 'doc/README', 'src/main.c'])
+
+    def test_send_only_what_changed(self):
+        self.rsync.send_all([], [])
+        result = self.rsync.send_all([], [])
+        self.assertEqual(result.files_transferred, 0)
+
+        write(os.path.join(self.project, 'src', 'main.c'), 'int main(void);\n')
+        os.utime(os.path.join(self.project, 'src', 'main.c'),
+                 ns=(0, os.stat(os.path.join(self.deployed, 'src', 'main.c')).st_mtime_ns
+                     + 10 ** 9))
+        result = self.rsync.send_all([], [])
+        self.assertEqual(result.files_transferred, 1)
+        self.assertEqual(read(os.path.join(self.deployed, 'src', 'main.c')),
+                         'int main(void);\n')
+
+    def deleting(self):
+        return rsync(self.cmd, self.logger, self.deployed, 'localhost',
+                     self.project, ['obj/'], check=False, delete=True)
+
+    def test_send_paths_keeps_deleted_files(self):
+        self.rsync.send_all([], [])
+        os.remove(os.path.join(self.project, 'doc', 'README'))
+        result = self.rsync.send_paths(['obj/main.o'], ['doc/README'])
+        self.assertEqual(result.status, 0)
+        self.assertEqual(self.deployed_files(), ['build.xml', 'doc/README', 'src/main.c'])
+
+    def test_send_paths_and_deletes(self):
+        self.rsync.send_all([], [])
+        os.remove(os.path.join(self.project, 'doc', 'README'))
+        result = self.deleting().send_paths(['obj/main.o'], ['doc/README'])
+        self.assertEqual(result.status, 0)
+        self.assertEqual(self.deployed_files(), ['build.xml', 'src/main.c'])
+
+    def test_send_all_keeps_deleted_files(self):
+        write(os.path.join(self.deployed, 'old.c'), 'old\n')
+        self.rsync.send_all([], [])
+        self.assertIn('old.c', self.deployed_files())
+
+    def test_send_all_and_deletes(self):
+        write(os.path.join(self.deployed, 'old.c'), 'old\n')
+        write(os.path.join(self.deployed, 'src', 'old.c'), 'old\n')
+        write(os.path.join(self.deployed, 'doc', 'old.txt'), 'old\n')
+        # excluded on the host is left alone, like rsync --delete.
+        write(os.path.join(self.deployed, 'obj', 'old.o'), 'old')
+        result = self.deleting().send_all(['src'], [])
+        self.assertEqual(result.status, 0)
+        self.assertEqual(self.deployed_files(),
+                         ['doc/old.txt', 'obj/old.o', 'old.c', 'src/main.c'])
+        self.deleting().send_all([], [])
+        self.assertEqual(self.deployed_files(),
+                         ['build.xml', 'doc/README', 'obj/old.o', 'src/main.c'])
+
+    def test_no_execute(self):
+        self.cmd.no_execute = True
+        self.rsync.send_all([], [])
+        self.assertEqual(self.deployed_files(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
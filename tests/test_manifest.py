@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+   The manifest, and what it says changed between deploys.
+"""
+
+__author__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__support__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__version__ = '$Revision: 1 $'[11:-2]
+
+import os
+import shutil
+import tempfile
+import unittest
+from rsync.manifest import manifest
+
+
+def write(path, contents):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(contents)
+
+
+class test_manifest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='PMtest.')
+        write(os.path.join(self.path, 'src', 'main.c'), 'int main;\n')
+        write(os.path.join(self.path, 'src', 'util.c'), 'int util;\n')
+        write(os.path.join(self.path, 'build', 'main.o'), 'object')
+        write(os.path.join(self.path, '.PM.log'), 'log')
+        write(os.path.join(self.path, '.PMresults'), 'results')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def tree(self, host='host'):
+        return manifest(self.path, host, ['build/'])
+
+    def test_scan_skips_excludes_and_state(self):
+        self.assertEqual(sorted(self.tree().scan()), ['src/main.c', 'src/util.c'])
+
+    def test_never_deployed(self):
+        self.assertIsNone(self.tree().changes())
+
+    def test_incremental(self):
+        tree = self.tree()
+        tree.scan()
+        tree.commit()
+        self.assertEqual(self.tree().changes(), ([], []))
+
+        write(os.path.join(self.path, 'src', 'main.c'), 'int main(void);\n')
+        write(os.path.join(self.path, 'src', 'new.c'), 'int new;\n')
+        os.remove(os.path.join(self.path, 'src', 'util.c'))
+        # the log changes every run, it isn't part of the tree.
+        write(os.path.join(self.path, '.PM.log'), 'more log')
+
+        tree = self.tree()
+        changed, deleted = tree.changes()
+        self.assertEqual(sorted(changed), ['src/main.c', 'src/new.c'])
+        self.assertEqual(deleted, ['src/util.c'])
+
+        tree.commit()
+        self.assertEqual(self.tree().changes(), ([], []))
+
+    def test_record(self):
+        tree = self.tree()
+        # nothing to add to for a host we never deployed to.
+        tree.record(tree.stat(['src/main.c']))
+        self.assertIsNone(tree.deployed())
+
+        tree.scan()
+        tree.commit()
+        write(os.path.join(self.path, 'src', 'main.c'), 'int main(void);\n')
+        write(os.path.join(self.path, 'src', 'new.c'), 'int new;\n')
+        write(os.path.join(self.path, 'src', 'unsent.c'), 'int unsent;\n')
+        os.remove(os.path.join(self.path, 'src', 'util.c'))
+        sent = tree.stat(['src/main.c', 'src/new.c', 'src/gone.c'])
+        self.assertEqual(sorted(sent), ['src/main.c', 'src/new.c'])
+        tree.record(sent, ['src/util.c'])
+
+        # only what was recorded counts as deployed.
+        self.assertEqual(self.tree().changes(), (['src/unsent.c'], []))
+
+    def test_hosts_are_separate(self):
+        tree = self.tree('one')
+        tree.scan()
+        tree.commit()
+        self.assertEqual(self.tree('one').changes(), ([], []))
+        self.assertIsNone(self.tree('two').changes())
+
+    def test_hashing_skips_touched_files(self):
+        tree = manifest(self.path, 'host', ['build/'], hashing=True)
+        tree.scan()
+        tree.commit()
+        main = os.path.join(self.path, 'src', 'main.c')
+        stat = os.stat(main)
+        os.utime(main, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        tree = manifest(self.path, 'host', ['build/'], hashing=True)
+        self.assertEqual(tree.changes(), ([], []))
+
+
+if __name__ == "__main__":
+    unittest.main()
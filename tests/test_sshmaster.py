@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+   Shared ssh master connections, against an ssh that only writes down how
+   it was called.
+"""
+
+__author__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__support__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__version__ = '$Revision: 1 $'[11:-2]
+
+import os
+import shlex
+import shutil
+import importlib
+import tempfile
+import unittest
+from unittest import mock
+
+# the module, rsync's sshmaster is the class.
+sshmaster = importlib.import_module('rsync.sshmaster')
+
+fake_ssh = """#!/bin/sh
+echo "$@" >> %s
+exit 0
+"""
+
+
+class test_sshmaster(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='PMtest.')
+        self.calls = os.path.join(self.path, 'calls')
+        ssh = os.path.join(self.path, 'ssh')
+        with open(ssh, 'w') as f:
+            f.write(fake_ssh % shlex.quote(self.calls))
+        os.chmod(ssh, 0o755)
+        path = '%s%s%s' % (self.path, os.pathsep, os.environ.get('PATH', ''))
+        self.patches = [mock.patch.dict(os.environ, {'PATH': path}),
+                        mock.patch.dict(sshmaster.masters, clear=True),
+                        mock.patch.object(sshmaster, 'socket_dir', None),
+                        mock.patch.object(sshmaster, 'socket_dir_owner', None)]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        sshmaster.close_all()
+        for patch in reversed(self.patches):
+            patch.stop()
+        shutil.rmtree(self.path)
+
+    def ssh_calls(self):
+        if not os.path.exists(self.calls):
+            return []
+        with open(self.calls) as f:
+            return f.read().splitlines()
+
+    def test_one_master_per_host(self):
+        master = sshmaster.get_master('host')
+        self.assertIs(sshmaster.get_master('host'), master)
+        self.assertIsNot(sshmaster.get_master('other'), master)
+        # nothing runs until a command uses it.
+        self.assertEqual(self.ssh_calls(), [])
+
+    def test_options(self):
+        master = sshmaster.get_master('host', persist='10m')
+        socket_dir = sshmaster.get_socket_dir()
+        self.assertEqual(os.stat(socket_dir).st_mode & 0o777, 0o700)
+        control_path = os.path.join(socket_dir, '%r@%h:%p')
+        self.assertEqual(master.control_path, control_path)
+        self.assertEqual(master.options(),
+                         '-o ControlMaster=auto -o ControlPath=%s '
+                         '-o ControlPersist=10m' % control_path)
+        self.assertEqual(master.ssh_command(), 'ssh %s' % master.options())
+
+    def test_remote_command(self):
+        master = sshmaster.get_master('host')
+        command = shlex.split(master.remote_command("echo 'a b'"))
+        self.assertEqual(command[-2:], ['host', "echo 'a b'"])
+        self.assertIn('ControlPath=%s' % master.control_path, command)
+
+    def test_close_all(self):
+        master = sshmaster.get_master('host')
+        socket_dir = sshmaster.socket_dir
+        sshmaster.close_all()
+        self.assertEqual(self.ssh_calls(),
+                         ['-o ControlPath=%s -O check host' % master.control_path,
+                          '-o ControlPath=%s -O exit host' % master.control_path])
+        self.assertEqual(sshmaster.masters, {})
+        self.assertFalse(os.path.exists(socket_dir))
+
+    def test_close_all_stops_forked_masters(self):
+        socket_dir = sshmaster.get_socket_dir()
+        open(os.path.join(socket_dir, 'user@host:22'), 'w').close()
+        sshmaster.close_all()
+        control_path = os.path.join(socket_dir, 'user@host:22')
+        self.assertIn('-o ControlPath=%s -O exit user@host' % control_path,
+                      self.ssh_calls())
+
+    def test_close_all_in_a_fork(self):
+        sshmaster.get_master('host')
+        socket_dir = sshmaster.socket_dir
+        with mock.patch.object(sshmaster, 'socket_dir_owner', -1):
+            sshmaster.close_all()
+        # the owner's masters are left for the next request.
+        self.assertEqual(self.ssh_calls(), [])
+        self.assertEqual(sshmaster.masters, {})
+        self.assertTrue(os.path.isdir(socket_dir))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+   Parsing rsync's --stats and --itemize-changes output.
+"""
+
+__author__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__support__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__version__ = '$Revision: 1 $'[11:-2]
+
+import unittest
+from rsync.stats import transfer_result
+
+rsync_output = """\
+sending incremental file list
+>f+++++++++ src/main.c
+>f.st...... README
+*deleting   old.txt
+
+Number of files: 12 (reg: 10, dir: 2)
+Number of created files: 1 (reg: 1)
+Number of deleted files: 1 (reg: 1)
+Number of regular files transferred: 2
+Total file size: 1,234,567 bytes
+Total transferred file size: 4,321 bytes
+Literal data: 4,000 bytes
+Matched data: 321 bytes
+File list size: 0
+File list generation time: 0.001 seconds
+File list transfer time: 0.000 seconds
+Total bytes sent: 4,500
+Total bytes received: 60
+
+sent 4,500 bytes  received 60 bytes  9,120.00 bytes/sec
+total size is 1,234,567  speedup is 270.74
+"""
+
+
+class test_transfer_result(unittest.TestCase):
+
+    def test_parse(self):
+        result = transfer_result.parse(rsync_output, 0, 1.5, 'host:.')
+        self.assertEqual(result.name, 'host:.')
+        self.assertEqual(result.transfers, 1)
+        self.assertEqual(result.files_considered, 12)
+        self.assertEqual(result.files_transferred, 2)
+        self.assertEqual(result.total_size, 1234567)
+        self.assertEqual(result.transferred_size, 4321)
+        self.assertEqual(result.literal_bytes, 4000)
+        self.assertEqual(result.matched_bytes, 321)
+        self.assertEqual(result.bytes_sent, 4500)
+        self.assertEqual(result.bytes_received, 60)
+        self.assertAlmostEqual(result.file_list_time, 0.001)
+        self.assertAlmostEqual(result.speedup, 270.74)
+        self.assertEqual(result.wall_time, 1.5)
+        self.assertEqual(result.changes, [('>f+++++++++', 'src/main.c'),
+                                          ('>f.st......', 'README'),
+                                          ('*deleting', 'old.txt')])
+
+    def test_transferred(self):
+        result = transfer_result.parse(rsync_output)
+        self.assertEqual(result.transferred, 4560)
+        self.assertEqual(result.as_dict()['transferred'], 4560)
+        # a local copy only knows what it wrote.
+        local = transfer_result()
+        local.literal_bytes = 100
+        self.assertEqual(local.transferred, 100)
+
+    def test_add(self):
+        total = transfer_result()
+        total.add(transfer_result.parse(rsync_output, 0, 1.0))
+        total.add(transfer_result.parse(rsync_output, 23, 2.0))
+        self.assertEqual(total.status, 23)
+        self.assertEqual(total.transfers, 2)
+        self.assertEqual(total.files_transferred, 4)
+        self.assertEqual(total.bytes_sent, 9000)
+        self.assertEqual(total.wall_time, 2.0)
+        self.assertEqual(len(total.changes), 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
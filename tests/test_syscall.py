@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+   Running commands through syscall, one at a time, on its pool, and a
+   line at a time.
+"""
+
+__author__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__support__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__version__ = '$Revision: 1 $'[11:-2]
+
+import sys
+import logging
+import unittest
+from application.application import syscall
+
+
+class test_syscall(unittest.TestCase):
+
+    def setUp(self):
+        logger = logging.getLogger('PMtest')
+        logger.addHandler(logging.NullHandler())
+        logger.propagate = False
+        self.cmd = syscall(logger, workers=2)
+        self.cmd.no_execute = None
+
+    def tearDown(self):
+        self.cmd.shutdown()
+
+    def python(self, code):
+        return [sys.executable, '-c', code]
+
+    def test_capture(self):
+        result = self.cmd.capture(self.python('print("hello")'))
+        self.assertEqual(result.status, 0)
+        self.assertEqual(result.output, 'hello\n')
+
+    def test_submit_and_gather(self):
+        futures = [self.cmd.submit(self.python('import sys; print(%d); sys.exit(%d)' % (i, i)),
+                                   capture=True)
+                   for i in range(4)]
+        results = self.cmd.gather(futures)
+        self.assertEqual([result.status for result in results], [0, 1, 2, 3])
+        self.assertEqual([result.output for result in results], ['0\n', '1\n', '2\n', '3\n'])
+
+    def test_shutdown(self):
+        self.cmd.gather([self.cmd.submit(self.python('pass'))])
+        self.assertIsNotNone(self.cmd.pool)
+        self.cmd.shutdown()
+        self.assertIsNone(self.cmd.pool)
+        # a new pool is made the next time one is needed.
+        self.assertEqual(self.cmd.gather([self.cmd.submit(self.python('pass'))])[0].status, 0)
+        self.cmd.shutdown()
+        self.cmd.shutdown()
+
+    def test_lines(self):
+        listing = self.cmd.lines(self.python('print("a"); print("b"); raise SystemExit(3)'))
+        self.assertEqual(list(listing), ['a\n', 'b\n'])
+        self.assertEqual(listing.result.status, 3)
+
+    def test_lines_without_the_program(self):
+        listing = self.cmd.lines(['/nonexistent/program'])
+        self.assertEqual(list(listing), [])
+        self.assertEqual(listing.result.status, 127)
+
+    def test_not_executing(self):
+        self.cmd.no_execute = True
+        self.assertEqual(self.cmd.run(self.python('raise SystemExit(1)')).status, 0)
+        self.assertEqual(list(self.cmd.lines(self.python('print("a")'))), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+   Merging sorted tags files and looking tags up in them.
+"""
+
+__author__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__support__ = 'Eric Gebhart <e.a.gebhart@gmail.com>'
+__version__ = '$Revision: 1 $'[11:-2]
+
+import os
+import shutil
+import tempfile
+import unittest
+from ctags.tagfile import merge_tags, find_tags
+
+header = (b'!_TAG_FILE_FORMAT\t2\t/extended format/\n'
+          b'!_TAG_FILE_SORTED\t1\t/0=unsorted, 1=sorted/\n')
+
+
+class test_tagfile(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='PMtest.')
+        self.tags_file = os.path.join(self.path, 'tags')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write(self, name, lines):
+        path = os.path.join(self.path, name)
+        with open(path, 'wb') as f:
+            f.write(header + b''.join(line + b'\n' for line in lines))
+        return path
+
+    def lines(self):
+        with open(self.tags_file, 'rb') as f:
+            return f.read().splitlines()
+
+    def test_merge(self):
+        one = self.write('one', [b'alpha\ta.c\t/^int alpha;$/;"\tv',
+                                 b'gamma\ta.c\t/^int gamma;$/;"\tv'])
+        two = self.write('two', [b'beta\tb.c\t/^int beta;$/;"\tv',
+                                 b'delta\tb.c\t/^int delta;$/;"\tv'])
+        self.assertEqual(merge_tags(self.tags_file, [one, two]), 4)
+        lines = self.lines()
+        # the header once, then every tag in order.
+        self.assertEqual(lines[:2], header.splitlines())
+        self.assertEqual([line.split(b'\t')[0] for line in lines[2:]],
+                         [b'alpha', b'beta', b'delta', b'gamma'])
+
+    def test_merge_replaces_dropped_files(self):
+        self.write('tags', [b'alpha\ta.c\t1;"\tv',
+                            b'beta\tb.c\t1;"\tv',
+                            b'gamma\tc.c\t1;"\tv'])
+        partial = self.write('partial', [b'beta2\tb.c\t2;"\tv'])
+        count = merge_tags(self.tags_file, [self.tags_file, partial],
+                           [b'b.c', b'c.c'])
+        self.assertEqual(count, 2)
+        self.assertEqual([line.split(b'\t')[0] for line in self.lines()[2:]],
+                         [b'alpha', b'beta2'])
+        self.assertEqual(sorted(os.listdir(self.path)), ['partial', 'tags'])
+
+    def test_find(self):
+        self.write('tags', [b'Main\tm.c\t/^int Main;$/;"\tv',
+                            b'main\tm.c\t/^int main(void)$/;"\tf\tline:3',
+                            b'main\tu.c\t7;"\tf',
+                            b'mainloop\tu.c\t9;"\tf\tclass:loop',
+                            b'zeta\tz.c\t1;"\tv'])
+        tags = find_tags(self.tags_file, 'main')
+        self.assertEqual([(tag['name'], tag['file']) for tag in tags],
+                         [('main', 'm.c'), ('main', 'u.c')])
+        self.assertEqual(tags[0]['address'], '/^int main(void)$/')
+        self.assertEqual(tags[0]['kind'], 'f')
+        self.assertEqual(tags[0]['line'], '3')
+
+        prefixed = find_tags(self.tags_file, 'main', prefix=True)
+        self.assertEqual([tag['name'] for tag in prefixed], ['main', 'main', 'mainloop'])
+        self.assertEqual(prefixed[2]['class'], 'loop')
+
+        self.assertEqual(find_tags(self.tags_file, 'Main')[0]['file'], 'm.c')
+        self.assertEqual(find_tags(self.tags_file, 'zeta')[0]['file'], 'z.c')
+        self.assertEqual(find_tags(self.tags_file, 'nothing'), [])
+        self.assertEqual(find_tags(self.tags_file, 'aaa'), [])
+
+    def test_find_without_tags(self):
+        self.assertEqual(find_tags(self.tags_file, 'main'), [])
+        open(self.tags_file, 'wb').close()
+        self.assertEqual(find_tags(self.tags_file, 'main'), [])
+
+
+if __name__ == "__main__":
+    unittest.main()